@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""
+CPU benchmarks of the local steps of the content-copy-tool.
+
+Times the steps that do not touch the network and grow with the data:
+reading the bookmap, rewriting the roles of a deposit receipt, cleaning and
+re-zipping a module export, building the multipart deposit, reading its
+boundary and finding the license on a wizard page. The inputs are generated
+in a temporary directory at the sizes of the chosen size set (--size
+large goes up to 100k bookmap rows and a 1 GB zip). Run it from the top
+directory of the tool:
+
+    python benchmarks/cpu.py run [--size small|medium|large] [-n RUNS] [--only NAME] [--save FILE]
+    python benchmarks/cpu.py compare BASELINE [CURRENT] [--threshold 0.10]
+
+'run --save' writes the results as json, to be kept as a baseline. 'compare'
+compares the fastest time of each benchmark with the baseline (running the
+benchmarks at the size of the baseline if CURRENT is not given) and exits
+with status 1 if one is slower by more than the threshold. Only compare
+results taken on the same machine.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import os.path as path
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+import zipfile
+
+here = path.abspath(path.dirname(__file__))
+sys.path.insert(0, path.join(path.dirname(here), 'contentcopytool', 'lib'))
+
+SIZES = {
+    'small': {'rows': [1000], 'zip_mb': [1], 'html_kb': [100], 'roles': [100]},
+    'medium': {'rows': [1000, 10000], 'zip_mb': [1, 10, 100], 'html_kb': [100, 1024], 'roles': [100, 1000]},
+    'large': {'rows': [1000, 10000, 100000], 'zip_mb': [1, 10, 100, 1000], 'html_kb': [100, 1024, 10240],
+              'roles': [100, 1000, 10000]},
+}
+CHAPTERS = 40
+FILE_MB = 4  # size of each media file of the generated zips
+
+BENCHMARKS = []  # (name, parameter, function)
+logger = logging.getLogger('benchmark')
+logger.addHandler(logging.NullHandler())
+
+
+def benchmark(parameter):
+    """
+    Registers a benchmark taking one value of [parameter] and the work
+    directory. It prepares its input and returns (setup, timed): setup (or
+    None) runs untimed before each run of timed.
+    """
+    def register(function):
+        BENCHMARKS.append((function.__name__, parameter, function))
+        return function
+    return register
+
+
+class Options:
+    """ The run options that Bookmap reads. """
+    chapters = None
+    exclude = None
+    workgroups = False
+
+
+def write_bookmap(filename, rows):
+    columns = ['Chapter Number', 'Chapter Title', 'Module Title', 'Production Module ID', 'Dev Module ID',
+               'Dev Workgroup']
+    with open(filename, 'wb') as bookmap_file:
+        writer = csv.writer(bookmap_file, delimiter='\t')
+        writer.writerow(columns)
+        for row in range(rows):
+            chapter = row * CHAPTERS // rows
+            writer.writerow([chapter, "Chapter %d" % chapter, "%d.%d Module %d" % (chapter, row, row),
+                             "m%05d" % row, "m%05d" % (row + 50000),
+                             "https://legacy.cnx.org/GroupWorkspaces/wg%d" % chapter])
+
+
+def bookmap_configuration():
+    from bookmap import BookmapConfiguration
+    return BookmapConfiguration('Chapter Number', 'Chapter Title', 'Module Title', 'Production Module ID',
+                                'Dev Module ID', 'Dev Workgroup', 'Unit Number', 'Unit Title', 'true')
+
+
+@benchmark('rows')
+def bookmap_convert(rows, workdir):
+    from bookmap import Bookmap
+    filename = path.join(workdir, 'book.tsv')
+    write_bookmap(filename, rows)
+    bookmap = Bookmap(filename, bookmap_configuration(), Options(), logger)
+
+    def timed():
+        with open(filename) as bookmap_file:
+            bookmap.convert(logger, csv.DictReader(bookmap_file, delimiter='\t'))
+    return None, timed
+
+
+@benchmark('rows')
+def safe_process_column(rows, workdir):
+    from bookmap import Bookmap, CNXModule
+    filename = path.join(workdir, 'book.tsv')
+    write_bookmap(filename, 10)
+    bookmap = Bookmap(filename, bookmap_configuration(), Options(), logger)
+    row = {'Chapter Number': '1', 'Chapter Title': 'Chapter 1', 'Module Title': 'Module',
+           'Production Module ID': 'm00001'}  # the destination and unit columns are missing
+    commands = [('module.source_id', 'row[self.config.source_module_ID_column]', 'default'),
+                ('module.destination_id', 'row[self.config.destination_module_ID_column]', 'default'),
+                ('module.destination_workspace_url', 'row[self.config.destination_workgroup_column]', 'default'),
+                ('module.chapter_number', 'row[self.config.chapter_number_column]', 'default'),
+                ('module.chapter_title', 'row[self.config.chapter_title_column]', 'default'),
+                ('module.unit_number', 'row[self.config.unit_number_column]', 'default'),
+                ('module.unit_title', 'row[self.config.unit_title_column]', '""')]
+
+    def timed():
+        for _ in xrange(rows):
+            module = CNXModule('Module')
+            for lhs, rhs, default in commands:
+                bookmap.safe_process_column(lhs, rhs, row, module, default)
+    return None, timed
+
+
+@benchmark('roles')
+def update_roles(roles, workdir):
+    from role_updates import RoleConfiguration, RoleUpdater
+    import role_updates
+    original = path.join(workdir, 'receipt.xml')
+    receipt = path.join(workdir, 'receipt.work.xml')
+    with open(original, 'w') as receipt_file:
+        receipt_file.write('<?xml version="1.0" encoding="utf-8"?>\n<entry xmlns="http://www.w3.org/2005/Atom">\n')
+        for index in range(roles):
+            for tag in ('dcterms:creator', 'oerdc:maintainer', 'dcterms:rightsHolder'):
+                receipt_file.write('<%s oerdc:id="user%d" oerdc:email="user%d@localhost.net" oerdc:pending="False">'
+                                   'First%d Last%d</%s>\n' % (tag, index, index, index, index, tag))
+            receipt_file.write('<dcterms:subject xsi:type="oerdc:Subjects">Science and Technology</dcterms:subject>\n')
+        receipt_file.write('</entry>\n')
+    replace_map = RoleUpdater(RoleConfiguration(['author1', 'author2'], ['maintainer1'], ['rightsholder1'], {},
+                                                'user:password')).prepare_role_updates()
+
+    def setup():
+        shutil.copy(original, receipt)
+    return setup, lambda: role_updates.update_roles(receipt, replace_map)
+
+
+def write_export(filename, size_mb):
+    """ Writes a module export zip of about size_mb MB: the cnxml, its html and incompressible media files. """
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as export:
+        paragraph = "<para id=\"p%d\">From the text of the module, a paragraph.</para>\n"
+        export.writestr('m00000/index.cnxml', ''.join(paragraph % index for index in range(2000)))
+        export.writestr('m00000/index.cnxml.html', ''.join(paragraph % index for index in range(2000)))
+        remaining = size_mb * 1024 * 1024
+        index = 0
+        while remaining > 0:
+            size = min(remaining, FILE_MB * 1024 * 1024)
+            export.writestr('m00000/media%d.bin' % index, os.urandom(size))
+            remaining -= size
+            index += 1
+
+
+def export_file(size_mb, workdir):
+    """ Returns the generated export of size_mb MB in workdir, shared by the benchmarks of that size. """
+    filename = path.join(workdir, 'export%d.zip' % size_mb)
+    if not path.exists(filename):
+        write_export(filename, size_mb)
+    return filename
+
+
+@benchmark('zip_mb')
+def clean_zip(size_mb, workdir):
+    from operation_objects import clean_zip
+    original = export_file(size_mb, workdir)
+    work = path.join(workdir, 'work.zip')
+
+    def setup():
+        shutil.copy(original, work)
+    return setup, lambda: clean_zip(work, workdir)
+
+
+@benchmark('zip_mb')
+def zipdir(size_mb, workdir):
+    from operation_objects import extract_zip, zipdir
+    original = export_file(size_mb, workdir)
+
+    def setup():
+        extract_zip(original)
+    return setup, lambda: zipdir(path.join(workdir, 'm00000'), path.join(workdir, 'rezipped.zip'))
+
+
+def atom_entry(workdir):
+    filename = path.join(workdir, 'entry.xml')
+    with open(filename, 'w') as entry:
+        entry.write('<?xml version="1.0" encoding="utf-8"?>\n<entry xmlns="http://www.w3.org/2005/Atom">'
+                    '<title>Module</title></entry>\n')
+    return filename
+
+
+@benchmark('zip_mb')
+def makemultipart_binary(size_mb, workdir):
+    import makemultipart
+    atom, package = atom_entry(workdir), export_file(size_mb, workdir)
+    return None, lambda: makemultipart.makemultipart_files(atom, package, path.join(workdir, 'deposit.mpart'),
+                                                           'binary')
+
+
+@benchmark('zip_mb')
+def makemultipart_base64(size_mb, workdir):
+    import makemultipart
+    atom, package = atom_entry(workdir), export_file(size_mb, workdir)
+    return None, lambda: makemultipart.makemultipart_files(atom, package, path.join(workdir, 'deposit.mpart'),
+                                                           'base64')
+
+
+@benchmark('zip_mb')
+def makemultipart_streaming(size_mb, workdir):
+    import makemultipart
+    atom, package = atom_entry(workdir), export_file(size_mb, workdir)
+    return None, lambda: makemultipart.makemultipart_streaming(atom, package, path.join(workdir, 'deposit.mpart'),
+                                                               'base64')
+
+
+@benchmark('zip_mb')
+def extract_boundary(size_mb, workdir):
+    import http_util
+    import makemultipart
+    mpart = path.join(workdir, 'boundary.mpart')
+    makemultipart.makemultipart_files(atom_entry(workdir), export_file(size_mb, workdir), mpart, 'binary')
+    return None, lambda: http_util.extract_boundary(mpart)
+
+
+class PageResponse:
+    """ Stands in for the streamed requests response of a wizard page. """
+    def __init__(self, content):
+        self.content = content
+        self.encoding = 'utf-8'
+        self.url = 'https://legacy.cnx.org/GroupWorkspaces/wg1/m00000/cc_license'
+
+    def iter_content(self, chunk_size=1):
+        for start in xrange(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+@benchmark('html_kb')
+def get_license(size_kb, workdir):
+    from operation_objects import ContentCreator
+    row = '<tr><td class="title"><a href="/content/m%05d/latest/">Module %d</a></td><td>&nbsp;</td></tr>\n'
+    body = []
+    length = 0
+    index = 0
+    while length < size_kb * 1024:
+        body.append(row % (index, index))
+        length += len(body[-1])
+        index += 1
+    page = ('<html><body><form>%s<input type="hidden" name="license" '
+            'value="http://creativecommons.org/licenses/by/4.0/" /></form></body></html>' % ''.join(body))
+    creator = ContentCreator('https://legacy.cnx.org', 'user:password')
+    return None, lambda: creator.get_license(PageResponse(page), logger)
+
+
+def run_benchmarks(size, runs, only=None):
+    """ Returns the results of the benchmarks at the size set [size]. """
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='cct-benchmark')
+    cwd = os.getcwd()
+    os.chdir(workdir)  # the zip steps extract to the current directory
+    try:
+        for name, parameter, function in BENCHMARKS:
+            if only and name not in only:
+                continue
+            for value in SIZES[size][parameter]:
+                key = "%s[%s=%s]" % (name, parameter, value)
+                setup, timed = function(value, workdir)
+                timings = []
+                for _ in range(runs):
+                    if setup:
+                        setup()
+                    start = timeit.default_timer()
+                    timed()
+                    timings.append(timeit.default_timer() - start)
+                timings.sort()
+                results[key] = {'min': timings[0], 'median': timings[len(timings) // 2], 'runs': runs}
+                sys.stderr.write("%-45s %10.2f ms\n" % (key, timings[0] * 1000))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'size': size, 'python': platform.python_version(), 'machine': platform.platform(), 'results': results}
+
+
+def compare(baseline, current, threshold):
+    """ Prints the changes of the fastest times and returns the names of the regressions. """
+    regressions = []
+    names = sorted(set(baseline['results']) | set(current['results']))
+    print("%-45s %12s %12s %8s" % ('benchmark', 'baseline', 'current', 'change'))
+    for name in names:
+        before = baseline['results'].get(name)
+        after = current['results'].get(name)
+        if before is None or after is None:
+            print("%-45s %12s %12s" % (name, "%.2f ms" % (before['min'] * 1000) if before else '-',
+                                       "%.2f ms" % (after['min'] * 1000) if after else '-'))
+            continue
+        change = after['min'] / before['min'] - 1 if before['min'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print("%-45s %9.2f ms %9.2f ms %+7.1f%%%s" %
+              (name, before['min'] * 1000, after['min'] * 1000, change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU benchmarks of the content-copy-tool')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--size', choices=sorted(SIZES), default='medium', help='Size set of the inputs')
+    run_parser.add_argument('-n', '--runs', type=int, default=5, help='Runs of each benchmark')
+    run_parser.add_argument('--only', action='append', choices=[name for name, _, _ in BENCHMARKS],
+                            help='Run only this benchmark (can be repeated)')
+    run_parser.add_argument('--save', help='Write the results as json to this file')
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('baseline', help='Results saved with run --save')
+    compare_parser.add_argument('current', nargs='?', help='Results to compare (default: run the benchmarks now)')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='Slowdown reported as a regression (default 0.10, 10%%)')
+    compare_parser.add_argument('-n', '--runs', type=int, default=5, help='Runs of each benchmark')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_benchmarks(args.size, args.runs, args.only)
+        if args.save:
+            with open(args.save, 'w') as results_file:
+                json.dump(results, results_file, indent=2, sort_keys=True)
+        return
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if args.current:
+        with open(args.current) as current_file:
+            current = json.load(current_file)
+    else:
+        only = sorted(set(name.split('[')[0] for name in baseline['results']))
+        current = run_benchmarks(baseline['size'], args.runs, only)
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print("%d regressions over %.0f%%" % (len(regressions), args.threshold * 100))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Import-time benchmark for the content-copy-tool.
+
+Spawns fresh interpreters that import the tool (or run one of the cheap CLI
+invocations) and reports the wall-clock time of each, along with which of the
+heavy network/packaging stacks ended up being imported. Run it from the top
+directory of the tool:
+
+    python benchmarks/import_time.py [-n RUNS] [--json]
+"""
+import argparse
+import json
+import os.path as path
+import subprocess
+import sys
+import time
+
+here = path.abspath(path.dirname(__file__))
+top = path.dirname(here)
+
+HEAVY_MODULES = ['requests', 'urllib2', 'httplib', 'email.MIMEMultipart', 'zipfile']
+
+SCENARIOS = [
+    ('import', "import contentcopytool.content_copy"),
+    ('--version', "import sys; sys.argv = ['content-copy', '--version']\n"
+                  "from contentcopytool.content_copy import main\n"
+                  "try:\n    main()\nexcept SystemExit:\n    pass"),
+    ('--help', "import sys; sys.argv = ['content-copy', '--help']\n"
+               "from contentcopytool.content_copy import main\n"
+               "try:\n    main()\nexcept SystemExit:\n    pass"),
+]
+
+PROBE = """
+import sys, json
+%s
+sys.stderr.write(json.dumps([m for m in %r if m in sys.modules]))
+"""
+
+
+def time_scenario(code, runs):
+    """ Returns (median seconds, heavy modules loaded) for running code in a fresh interpreter. """
+    timings = []
+    loaded = []
+    with open(path.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            process = subprocess.Popen([sys.executable, '-c', PROBE % (code, HEAVY_MODULES)], cwd=top,
+                                       stdout=devnull, stderr=subprocess.PIPE)
+            err = process.communicate()[1]
+            timings.append(time.time() - start)
+            try:
+                loaded = json.loads(err.strip().splitlines()[-1])
+            except (ValueError, IndexError):
+                loaded = ['<unknown: %s>' % err.strip()]
+    timings.sort()
+    return timings[len(timings) // 2], loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure content-copy start-up time')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='Interpreter launches per scenario')
+    parser.add_argument('--json', action='store_true', help='Print the results as json')
+    args = parser.parse_args()
+
+    baseline, _ = time_scenario('pass', args.runs)
+    results = {'interpreter': baseline, 'scenarios': {}}
+    for name, code in SCENARIOS:
+        median, loaded = time_scenario(code, args.runs)
+        results['scenarios'][name] = {'median': median, 'over_interpreter': median - baseline,
+                                      'heavy_modules': loaded}
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    print("bare interpreter: %.1f ms" % (baseline * 1000))
+    for name, _ in SCENARIOS:
+        result = results['scenarios'][name]
+        print("%-10s %7.1f ms (+%.1f ms)  heavy modules: %s" %
+              (name, result['median'] * 1000, result['over_interpreter'] * 1000,
+               ', '.join(result['heavy_modules']) or 'none'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+A local stand-in for the SWORD endpoint of a destination server.
+
+It accepts multipart/related deposits on any url ending in /sword, decodes
+the payload part according to its Content-Transfer-Encoding and stores the
+deposited package in the deposit directory as [module id].zip. As a source
+server, it answers .../rhaptos-deposit-receipt with the receipt of the
+sample module (SOURCE_RECEIPT, in the format of the Rhaptos receipts).
+
+    python benchmarks/sword_standin.py serve [--port 8808] [--deposits DIR]
+    python benchmarks/sword_standin.py check [--encoding binary|base64] [zipfile]
+
+'check' deposits a zip through http_util.http_upload_file against a stand-in
+running in the background and compares the deposited zip byte for byte. It
+also fetches the receipt of the sample module and checks that every line of
+the receipt deposit_receipt.py writes for it (but <updated>) is in the
+fetched receipt, byte for byte and in the same order.
+"""
+import argparse
+import email
+import os
+import os.path as path
+import sys
+import threading
+import zipfile
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+here = path.abspath(path.dirname(__file__))
+sys.path.insert(0, path.join(path.dirname(here), 'contentcopytool', 'lib'))
+
+RECEIPT = """<?xml version="1.0" encoding="utf-8"?>
+<entry xmlns="http://www.w3.org/2005/Atom"><id>%s</id></entry>
+"""
+
+SOURCE_RECEIPT = """<?xml version="1.0" encoding="utf-8"?>
+<entry xmlns="http://www.w3.org/2005/Atom"
+       xmlns:sword="http://purl.org/net/sword/"
+       xmlns:dcterms="http://purl.org/dc/terms/"
+       xmlns:md="http://cnx.rice.edu/mdml"
+       xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+       xmlns:oerdc="http://cnx.org/aboutus/technology/schemas/oerdc">
+    <title>Sample &amp; Module</title>
+    <id>http://127.0.0.1/content/m00000/latest/</id>
+    <updated>2016-01-01T00:00:00Z</updated>
+    <summary type="text">A module to check the receipts.</summary>
+    <dcterms:identifier xsi:type="dcterms:URI">http://127.0.0.1/content/m00000/latest/</dcterms:identifier>
+    <dcterms:title>Sample &amp; Module</dcterms:title>
+    <dcterms:abstract>A module to check the receipts.</dcterms:abstract>
+    <dcterms:language xsi:type="ISO639-1">en</dcterms:language>
+    <dcterms:creator oerdc:id="user1" oerdc:email="user1@localhost.net" oerdc:pending="False">First1 Last1</dcterms:creator>
+    <oerdc:maintainer oerdc:id="user2" oerdc:email="user2@localhost.net" oerdc:pending="False">First2 Last2</oerdc:maintainer>
+    <dcterms:rightsHolder oerdc:id="user1" oerdc:email="user1@localhost.net" oerdc:pending="False">First1 Last1</dcterms:rightsHolder>
+    <oerdc:translator oerdc:id="user3" oerdc:email="user3@localhost.net" oerdc:pending="False">First3 Last3</oerdc:translator>
+    <dcterms:subject xsi:type="oerdc:Subjects">Science and Technology</dcterms:subject>
+    <dcterms:subject>receipts</dcterms:subject>
+    <dcterms:license xsi:type="dcterms:URI">http://creativecommons.org/licenses/by/4.0/</dcterms:license>
+</entry>
+"""
+
+SOURCE_CNXML = """<document xmlns="http://cnx.rice.edu/cnxml" xmlns:md="http://cnx.rice.edu/mdml">
+<title>Sample &amp; Module</title>
+<metadata>
+  <md:title>Sample &amp; Module</md:title>
+  <md:language>en</md:language>
+  <md:license url="http://creativecommons.org/licenses/by/4.0/"/>
+  <md:actors>
+    <md:person userid="user1"><md:firstname>First1</md:firstname><md:surname>Last1</md:surname>
+      <md:fullname>First1 Last1</md:fullname><md:email>user1@localhost.net</md:email></md:person>
+    <md:person userid="user2"><md:firstname>First2</md:firstname><md:surname>Last2</md:surname>
+      <md:fullname>First2 Last2</md:fullname><md:email>user2@localhost.net</md:email></md:person>
+    <md:person userid="user3"><md:firstname>First3</md:firstname><md:surname>Last3</md:surname>
+      <md:fullname>First3 Last3</md:fullname><md:email>user3@localhost.net</md:email></md:person>
+  </md:actors>
+  <md:roles>
+    <md:role type="author">user1</md:role>
+    <md:role type="maintainer">user2</md:role>
+    <md:role type="licensor">user1</md:role>
+    <md:role type="translator">user3</md:role>
+  </md:roles>
+  <md:subjectlist><md:subject>Science and Technology</md:subject></md:subjectlist>
+  <md:keywordlist><md:keyword>receipts</md:keyword></md:keywordlist>
+  <md:abstract>A module to check the receipts.</md:abstract>
+</metadata>
+<content><para id="p1">From here on, binary.</para></content>
+</document>
+"""
+
+
+class SwordStandInHandler(BaseHTTPRequestHandler):
+    deposits = '.'
+
+    def do_GET(self):
+        if not self.path.split('?')[0].endswith('/rhaptos-deposit-receipt'):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/atom+xml')
+        self.send_header('Content-Length', str(len(SOURCE_RECEIPT)))
+        self.end_headers()
+        self.wfile.write(SOURCE_RECEIPT)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        url_path = self.path.split('?')[0].rstrip('/')
+        if not url_path.endswith('/sword'):
+            self.send_error(404)
+            return
+        message = email.message_from_string("Content-Type: %s\n\n%s" % (self.headers.getheader('Content-Type'), body))
+        packages = [part for part in message.walk() if part.get_content_type() == 'application/zip']
+        if not message.is_multipart() or not packages:
+            self.send_error(400, "No package in deposit")
+            return
+        module_id = url_path.split('/')[-2]
+        with open(path.join(self.deposits, "%s.zip" % module_id), 'wb') as deposited:
+            deposited.write(packages[0].get_payload(decode=True))
+        receipt = RECEIPT % module_id
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/atom+xml')
+        self.send_header('Content-Length', str(len(receipt)))
+        self.end_headers()
+        self.wfile.write(receipt)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_standin(port, deposits):
+    """ Starts the stand-in in a background thread and returns the server. """
+    class Handler(SwordStandInHandler):
+        pass
+    Handler.deposits = deposits
+    server = HTTPServer(('127.0.0.1', port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def make_sample_zip(filename, size=2 * 1024 * 1024):
+    """ Writes a zip with incompressible and text entries, including a line starting with 'From '. """
+    with zipfile.ZipFile(filename, 'w') as zipf:
+        zipf.writestr('m00000/index.cnxml', SOURCE_CNXML)
+        zipf.writestr('m00000/media.bin', os.urandom(size))
+
+
+def check(encoding, package, deposits):
+    import http_util
+    server = start_standin(0, deposits)
+    atom = path.join(deposits, 'entry.xml')
+    with open(atom, 'w') as entry:
+        entry.write(RECEIPT % 'm00000')
+    url = "http://127.0.0.1:%d/GroupWorkspaces/wg1/m00000/sword" % server.server_address[1]
+    response, mpart, _ = http_util.http_upload_file(atom, package, url, 'user:password', encoding=encoding)
+    server.shutdown()
+    upload_size = path.getsize(mpart)
+    os.remove(mpart)
+    with open(package, 'rb') as original:
+        with open(path.join(deposits, 'm00000.zip'), 'rb') as deposited:
+            identical = original.read() == deposited.read()
+    print("%s: status %s, package %d bytes, upload %d bytes (%.1f%%), identical: %s" %
+          (encoding, response.status, path.getsize(package), upload_size,
+           100.0 * upload_size / path.getsize(package), identical))
+    return identical
+
+
+def check_receipt(package, deposits):
+    """ Compares the receipt written for the package with the one fetched from the stand-in. """
+    import urllib2
+    import deposit_receipt
+    server = start_standin(0, deposits)
+    try:
+        fetched = urllib2.urlopen("http://127.0.0.1:%d/content/m00000/latest/rhaptos-deposit-receipt" %
+                                  server.server_address[1]).read()
+    finally:
+        server.shutdown()
+    written = path.join(deposits, 'm00000.written.xml')
+    deposit_receipt.write_receipt(package, written, 'Module', ['user1'], ['user2'], ['user1'])
+    with open(written) as receipt_file:
+        lines = [line for line in receipt_file.read().splitlines()
+                 if line.strip() and not line.strip().startswith('<updated>')]
+    fetched_lines = fetched.splitlines()
+    missing = []
+    position = 0
+    for line in lines:
+        if line in fetched_lines[position:]:
+            position = fetched_lines.index(line, position) + 1
+        else:
+            missing.append(line)
+    print("receipt: %d lines written, %d not in the fetched receipt%s" %
+          (len(lines), len(missing), ''.join("\n  %s" % line for line in missing)))
+    return not missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SWORD stand-in server')
+    subparsers = parser.add_subparsers(dest='command')
+    serve_parser = subparsers.add_parser('serve')
+    serve_parser.add_argument('--port', type=int, default=8808)
+    serve_parser.add_argument('--deposits', default='.')
+    check_parser = subparsers.add_parser('check')
+    check_parser.add_argument('--encoding', choices=['binary', 'base64'], default=None,
+                              help='Check only this encoding (default: both)')
+    check_parser.add_argument('package', nargs='?', help='Zip file to deposit (default: a generated one)')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = start_standin(args.port, args.deposits)
+        print("SWORD stand-in listening on http://127.0.0.1:%d" % server.server_address[1])
+        try:
+            while True:
+                threading.Event().wait(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    import tempfile
+    import shutil
+    deposits = tempfile.mkdtemp()
+    try:
+        package = args.package
+        if not package:
+            package = path.join(deposits, 'm00000.source.zip')
+            make_sample_zip(package)
+        encodings = [args.encoding] if args.encoding else ['binary', 'base64']
+        results = [check(encoding, package, deposits) for encoding in encodings]
+        if not args.package:  # the receipt of the sample module
+            results.append(check_receipt(package, deposits))
+    finally:
+        shutil.rmtree(deposits)
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,12 @@
-import os.path as path
 import sys
 import traceback
+import re as regex
 import lib.util as util
 import lib.command_line_interface as cli
-from lib.operation_objects import *
-from lib.bookmap import *
-from lib.role_updates import *
+from lib.util import CCTError
 import subprocess
 import signal
+import time
 
 """
 This script is the main script of the content-copy-tool, it requires the
@@ -22,16 +21,34 @@ http_util.py
 command_line_interface.py
 """
 
-here = path.abspath(path.dirname(__file__))
-version = {}
-with open(path.join(here, '__version__.py')) as f:
-  exec(f.read(), version)
+from __version__ import __version__
 
-VERSION = 'Content-Copy-Tool v%s' % version['__version__']
+VERSION = 'Content-Copy-Tool v%s' % __version__
 PRODUCTION = True
 
 
 def run(settings, input_file, run_options):
+    # the feature modules are only loaded for a run, --help and --version do not need them
+    import lib.http_util as http_util
+    import lib.offload as offload
+    import lib.tracing as tracing
+    import lib.bundle as bundle
+    import lib.memory as memory
+    import lib.bandwidth as bandwidth
+    import lib.scheduling as scheduling
+    from lib.operation_objects import (CopyConfiguration, RoleConfiguration, Destination, Copier, ContentCreator,
+                                       LiveSource)
+    from lib.bookmap import BookmapConfiguration, Bookmap
+    from lib.role_updates import RoleUpdater
+    from lib.profiling import PhaseProfiler
+    from lib.cassette import Cassette
+    from lib.progress import ProgressReporter
+    from lib.metrics import MetricsExporter, MetricsRegistry, TrackedFailures
+    from lib.verification import Verifier
+    from lib.inventory import Inventory
+    from lib.preflight import Preflight
+    from lib.prefetch import PrefetchSource
+    from lib.collection_export import CollectionExportSource
     try:
         config = util.parse_json(settings)
     except Exception, e:
@@ -45,76 +62,257 @@ def run(settings, input_file, run_options):
     logfile = config['logfile']
     logger = util.init_logger(logfile)
     logger.debug("Logger is up and running.")
+    profiler = PhaseProfiler(run_options.profile)
+    if run_options.record:
+        http_util.cassette = Cassette(run_options.record, 'record')
+    elif run_options.replay:
+        http_util.cassette = Cassette(run_options.replay, 'replay', run_options.replay_speed)
+    if run_options.trace:
+        tracing.tracer = tracing.Tracer(run_options.trace)
+    if config.get('memory_budget_mb'):
+        memory.budget = int(config['memory_budget_mb']) * 1024 * 1024
+    if run_options.memory:
+        memory.monitor = memory.MemoryMonitor()
+    if config.get('bandwidth_limits'):
+        bandwidth.governor = bandwidth.Governor(bandwidth.parse_limits(config['bandwidth_limits']))
+    registry = None
+    exporter = None
+    if run_options.metrics_port is not None or run_options.metrics_file:
+        registry = MetricsRegistry()
+        exporter = MetricsExporter(registry, run_options.metrics_port, run_options.metrics_file)
+        if exporter.url():
+            logger.info("Metrics are served on \033[95m%s\033[0m" % exporter.url())
+    progress = ProgressReporter(logger, observers=[registry] if registry else None)
+
+    # Destinations: the one in the settings, or each entry of "destinations" (which overrides the settings)
+    destination_configs = [dict(config.items() + destination.items()) for destination in
+                           config.get('destinations') or [{}]]
+    names = [destination_config.get('name') for destination_config in destination_configs]
+    if len(names) > 1 and (None in names or len(set(names)) < len(names)):
+        print("Each entry of destinations in the settings file must have its own name.")
+        sys.exit(1)
 
-    # Bookmap
-    bookmap_config = BookmapConfiguration(str(config['chapter_number_column']),
-                                          str(config['chapter_title_column']),
-                                          str(config['module_title_column']),
-                                          str(config['source_module_ID_column']),
-                                          str(config['destination_module_ID_column']),
-                                          str(config['destination_workgroup_column']),
-                                          str(config['unit_number_column']),
-                                          str(config['unit_title_column']),
-                                          str(config['strip_section_numbers']))
-    logger.debug("Bookmap configuration has been created")
-    bookmap = Bookmap(input_file, bookmap_config, run_options, logger)
-    logger.debug("Bookmap has been created")
+    # Bookmap, one for each destination, read with its destination columns
+    with profiler.phase('parse'), tracing.phase('parse'), memory.phase('parse'):
+        bookmaps = []
+        for destination_config in destination_configs:
+            bookmap_config = BookmapConfiguration(str(config['chapter_number_column']),
+                                                  str(config['chapter_title_column']),
+                                                  str(config['module_title_column']),
+                                                  str(config['source_module_ID_column']),
+                                                  str(destination_config['destination_module_ID_column']),
+                                                  str(destination_config['destination_workgroup_column']),
+                                                  str(config['unit_number_column']),
+                                                  str(config['unit_title_column']),
+                                                  str(config['strip_section_numbers']))
+            logger.debug("Bookmap configuration has been created")
+            bookmaps.append(Bookmap(input_file, bookmap_config, run_options, logger, destination_config.get('name')))
+            logger.debug("Bookmap has been created")
+        bookmap = bookmaps[0]
 
     # Copy Configuration and Copier
     source_server = str(config['source_server'])
-    destination_server = str(config['destination_server'])
     # ensure server addresses have 'http[s]://' prepended
     if not regex.match(r'https?://', source_server):
         source_server = "http://%s" % source_server
-    if not regex.match(r'https?://', destination_server):
-        destination_server = "http://%s" % destination_server
-    credentials = str(config['destination_credentials'])
-    copy_config = CopyConfiguration(source_server, destination_server, credentials)
-    copier = Copier(copy_config, bookmap.bookmap, str(config['path_to_tool']))
+    failures = TrackedFailures(registry) if registry else []
+    inventory = None
+    if config.get('inventory'):
+        inventory = Inventory(str(config['inventory']), bookmap.booktitle)
+    destinations = []
+    for destination_config, destination_bookmap in zip(destination_configs, bookmaps):
+        destination_server = str(destination_config['destination_server'])
+        if not regex.match(r'https?://', destination_server):
+            destination_server = "http://%s" % destination_server
+        credentials = str(destination_config['destination_credentials'])
+        # the settings of a destination entry override the ones of the settings file
+        upload_encoding = str(destination_config.get('upload_encoding', 'base64'))
+        if upload_encoding not in ('binary', 'base64'):
+            print("Unknown upload_encoding in settings file: %s, use binary or base64." % upload_encoding)
+            sys.exit(1)
+        copy_workers = int(destination_config.get('copy_workers', 1))
+        destination_copy_config = CopyConfiguration(source_server, destination_server, credentials, upload_encoding,
+                                                    copy_workers,
+                                                    destination_config.get('export_size_cache', 'export-sizes.json'
+                                                                           if copy_workers > 1 else None),
+                                                    bool(config.get('synthesize_receipts', False)),
+                                                    destination_config.get('name'),
+                                                    int(destination_config.get('upload_retries', 3)))
+        destinations.append(Destination(destination_copy_config, destination_bookmap,
+                                        ContentCreator(destination_server, credentials, inventory), failures))
+    copy_config = destinations[0].copy_config
+    credentials = copy_config.credentials
+    logger.debug("ContentCreator has been created.")
+    source = None
+    if run_options.import_bundle:  # copy from the bundle instead of the source server
+        try:
+            source = bundle.BundleSource(bundle.BundleReader(run_options.import_bundle))
+        except (util.CCTError, IOError) as e:
+            logger.error("Cannot read the bundle %s: %s" % (run_options.import_bundle, getattr(e, 'msg', e)))
+            sys.exit(1)
+        logger.info("Bundle \033[95m%s\033[0m: %d modules exported from %s on %s" %
+                    (run_options.import_bundle, source.reader.metadata.get('modules', 0),
+                     source.reader.metadata.get('source_server'), source.reader.metadata.get('created')))
+    copier = Copier(copy_config, bookmap.bookmap, str(config['path_to_tool']), source, destinations[1:])
     logger.debug("Copier has been created")
     # Role Configuration
     role_config = RoleConfiguration(list(config['authors']),
                                     list(config['maintainers']),
                                     list(config['rightsholders']), config, credentials)
     logger.debug("Role configuration has been created.")
-    # Content_creator
-    content_creator = ContentCreator(destination_server, credentials)
-    logger.debug("ContentCreator has been created.")
-    failures = []
-
-    user_confirm(logger, copy_config, bookmap, run_options, role_config)  # Check before you run
 
+    with profiler.phase('validate'), tracing.phase('validate'), memory.phase('validate'):
+        problems = 0
+        for destination in destinations:
+            problems += validate_input(logger, destination.bookmap, destination.copy_config, run_options,
+                                       destination.failures, copier.source)
+
+    collection_source = None
+    if run_options.source_collection:  # the module exports are taken from the complete zip of the collection
+        collection_source = CollectionExportSource(copier.source, run_options.source_collection, logger)
+        copier.source = collection_source
+    prefetch = None
+    prefetch_modules = int(config.get('prefetch_modules', 10))
+    if (run_options.copy or run_options.export_bundle) and not run_options.dryrun and prefetch_modules > 0 \
+            and isinstance(copier.source, LiveSource):  # downloads the first exports while the summary is read
+        modules = [module for module in bookmap.bookmap.modules
+                   if module.valid and module.chapter_number in bookmap.chapters and module.source_id]
+        if copy_config.copy_workers > 1:  # the workers start with the largest exports, the sizes known so far
+            sizes = {}
+            for module in modules:
+                size = copier.size_cache.get(scheduling.export_key(source_server, module.source_id))
+                if size is not None:
+                    sizes[module.source_id] = size
+            modules = scheduling.largest_first(modules, sizes)
+        source_ids = []
+        for module in modules:
+            if module.source_id not in source_ids and len(source_ids) < prefetch_modules:
+                source_ids.append(module.source_id)
+        prefetch = PrefetchSource(copier.source, source_ids,
+                                  not (run_options.roles and copy_config.synthesize_receipts))
+        copier.source = prefetch
+        prefetch.start()
+    preflight = None
+    # looks the modules up while the summary waits for the user, a dry run leaves the servers alone
+    if int(config.get('preflight_workers', 8)) > 0 and not run_options.dryrun:
+        preflight = Preflight(destinations, run_options, copier.source, int(config.get('preflight_workers', 8)))
+        preflight.start()
+    try:  # Check before you run
+        user_confirm(logger, copy_config, bookmap, run_options, role_config, problems, destinations, preflight,
+                     copier.size_cache, prefetch)
+    except util.TerminateError:
+        if prefetch:
+            prefetch.cancel()
+        raise
+
+    http_util.listeners.append(progress)
+    if registry:
+        http_util.listeners.append(registry)
+    if tracing.tracer:
+        http_util.listeners.append(tracing.tracer)
+    if bandwidth.governor:
+        http_util.listeners.append(bandwidth.governor)
     try:
         logger.debug("Beginning processing.")
+        if run_options.export_bundle and not run_options.dryrun:  # pull the source content into a bundle
+            with profiler.phase('export'), tracing.phase('export'), memory.phase('export'):
+                exported = bundle.export_modules(copier.source,
+                                                 [module for module in bookmap.bookmap.modules
+                                                  if module.valid and module.chapter_number in run_options.chapters],
+                                                 run_options.export_bundle,
+                                                 {'source_server': source_server, 'book': bookmap.booktitle,
+                                                  'input_file': input_file, 'chapters': bookmap.chapters},
+                                                 copy_config.copy_workers, logger, failures, progress)
+            logger.info("Exported %d modules to the bundle \033[95m%s\033[0m" % (exported, run_options.export_bundle))
         if run_options.modules or run_options.workgroups:  # create placeholders
-            create_placeholders(logger, bookmap, copy_config, run_options, content_creator, failures)
-            output = bookmap.save(run_options.units)  # save output data
-            logger.debug("Finished created placeholders, output has been saved: %s." % output)
+            with profiler.phase('placeholders'), tracing.phase('placeholders'), memory.phase('placeholders'):
+                for destination in each_destination(logger, destinations):
+                    create_placeholders(logger, destination.bookmap, destination.copy_config, run_options,
+                                        destination.content_creator, destination.failures, progress)
+            outputs = [destination.bookmap.save(run_options.units) for destination in destinations]  # save output data
+            logger.debug("Finished created placeholders, output has been saved: %s." % ', '.join(outputs))
         if run_options.copy:  # copy content
-            copier.copy_content(role_config, run_options, logger, failures)
+            if not run_options.dryrun:  # a dry run does not touch the zips, it needs no process pool
+                # the offloaded steps do not log, so the pool can be forked while the other threads run
+                from multiprocessing import cpu_count
+                offload.start(int(config.get('cpu_workers',
+                                             cpu_count() if int(config.get('copy_workers', 1)) > 1 else 1)))
+            with profiler.phase('copy'), tracing.phase('copy'), memory.phase('copy'):
+                copier.copy_content(role_config, run_options, logger, destinations[0].failures, progress)
             logger.debug("Finished copying content.")
         if run_options.accept_roles and not run_options.dryrun:  # accept all pending role requests
-            RoleUpdater(role_config).accept_roles(copy_config, logger, failures)
+            with profiler.phase('roles'), tracing.phase('roles'), memory.phase('roles'):
+                for destination in each_destination(logger, destinations):
+                    RoleUpdater(role_config).accept_roles(destination.copy_config, logger, destination.failures)
             logger.debug("Finished updating roles.")
         if run_options.collections:  # create and populate the collection
-            create_populate_and_publish_collection(content_creator, copy_config, bookmap, run_options.units,
-                                                   run_options.publish_collection, run_options.dryrun, logger, failures)
+            with profiler.phase('collection'), tracing.phase('collection'), memory.phase('collection'):
+                for destination in each_destination(logger, destinations):
+                    create_populate_and_publish_collection(destination.content_creator, destination.copy_config,
+                                                           destination.bookmap, run_options.units,
+                                                           run_options.publish_collection, run_options.dryrun,
+                                                           logger, destination.failures)
             logger.debug("Finished creating and populating the collection.")
         if run_options.publish:  # publish the modules
-            publish_modules_post_copy(copier, content_creator, run_options, credentials, logger, failures)
+            with profiler.phase('publish'), tracing.phase('publish'), memory.phase('publish'):
+                for destination in each_destination(logger, destinations):
+                    publish_modules_post_copy(destination.bookmap.bookmap, destination.content_creator, run_options,
+                                              destination.copy_config.credentials, logger, destination.failures,
+                                              progress)
             logger.debug("Finished publishing modules.")
+        if run_options.verify and not run_options.dryrun:  # compare the destination content with the source
+            with profiler.phase('verify'), tracing.phase('verify'), memory.phase('verify'):
+                for destination in each_destination(logger, destinations):
+                    verifier = Verifier(destination.copy_config, copier.source_digests,
+                                        int(config.get('verify_workers', 4)))
+                    verifier.verify([module for module in destination.bookmap.bookmap.modules
+                                     if module.valid and module.chapter_number in run_options.chapters and
+                                     module.destination_id and module.source_id],
+                                    logger, destination.failures, progress)
+            logger.debug("Finished verifying modules.")
     except (CCTError, util.TerminateError, util.SkipSignal) as e:
-        output = bookmap.save(run_options.units, True)
+        outputs = [destination.bookmap.save(run_options.units, True) for destination in destinations]
         logger.error(e.msg)
+    finally:
+        offload.stop()
+        progress.finish_phase()
+        http_util.listeners.remove(progress)
+        if registry:
+            http_util.listeners.remove(registry)
+        if tracing.tracer:
+            http_util.listeners.remove(tracing.tracer)
+        if prefetch:
+            prefetch.close()
+        if collection_source:
+            collection_source.close()
+        if bandwidth.governor:
+            http_util.listeners.remove(bandwidth.governor)
 
     if run_options.modules or run_options.workgroups:
-        logger.info("See output: \033[95m%s\033[0m" % output)
+        for output in outputs:
+            logger.info("See output: \033[95m%s\033[0m" % output)
     print_failures(logger, failures)
+    profiler.report(logger)
+    if http_util.cassette is not None:
+        http_util.cassette.close()
+        logger.info(http_util.cassette.summary())
+        http_util.cassette = None
+    if memory.monitor:
+        memory.monitor.stop()
+        memory.monitor.report(logger)
+        memory.monitor = None
+    if tracing.tracer:
+        logger.info("Wrote %d spans to the trace \033[95m%s\033[0m" % (tracing.tracer.save(), run_options.trace))
+        tracing.tracer = None
+    if inventory is not None:
+        inventory.close()
+    if exporter:
+        exporter.stop()
     logger.info("------- Process completed --------")
     return bookmap.booktitle
 
 
-def create_placeholders(logger, bookmap, copy_config, run_options, content_creator, failures):
+def create_placeholders(logger, bookmap, copy_config, run_options, content_creator, failures, progress=None):
     """
     Creates placeholder modules on the destination server (and workgroups if enables).
 
@@ -125,10 +323,12 @@ def create_placeholders(logger, bookmap, copy_config, run_options, content_creat
         run_options - the input running options, what the tool should be doing
         content_creator - the content creator object
         failures - the list of failures to track failed placeholder creations
+        progress - (optional) the progress reporter
 
     Returns:
         None
     """
+    import lib.tracing as tracing
     if run_options.workgroups:
         logger.info("-------- Creating workgroups ------------------------")
         chapter_to_workgroup = {}
@@ -162,6 +362,9 @@ def create_placeholders(logger, bookmap, copy_config, run_options, content_creat
         logger.debug("Operating on these chapters now: %s" % bookmap.chapters)
 
     logger.info("-------- Creating modules -------------------------------")
+    if progress:
+        progress.start_phase('placeholders', len([module for module in bookmap.bookmap.modules
+                                                  if module.valid and module.chapter_number in bookmap.chapters]))
     for module in bookmap.bookmap.modules:
         if module.valid and module.chapter_number in bookmap.chapters:
             workgroup_url = 'Members/'
@@ -172,9 +375,10 @@ def create_placeholders(logger, bookmap, copy_config, run_options, content_creat
                              (module.title, module.destination_workspace_url))
                 workgroup_url = module.destination_workspace_url
             try:
-                content_creator.run_create_and_publish_module(module, copy_config.destination_server, 
-                                                              copy_config.credentials, logger, workgroup_url, 
-                                                              dryrun=run_options.dryrun)
+                with tracing.span('create placeholder', title=module.title, chapter=module.chapter_number):
+                    content_creator.run_create_and_publish_module(module, copy_config.destination_server,
+                                                                  copy_config.credentials, logger, workgroup_url,
+                                                                  dryrun=run_options.dryrun)
                 if run_options.workgroups:
                     chapter_to_workgroup[module.chapter_number].add_module(module)
                     chapter_to_workgroup[module.chapter_number].unit_number = module.unit_number
@@ -190,6 +394,10 @@ def create_placeholders(logger, bookmap, copy_config, run_options, content_creat
                 logger.error("Module %s failed to be created. " % module.title)
                 module.valid = False
                 failures.append((module.full_title(), " creating placeholder"))
+            if progress:
+                progress.module_done(module.valid)
+    if progress:
+        progress.finish_phase()
 
 
 def create_populate_and_publish_collection(content_creator, copy_config, bookmap, units, publish_collection, dry_run,
@@ -307,28 +515,44 @@ def create_populate_and_publish_collection(content_creator, copy_config, bookmap
             return None
 
 
-def publish_modules_post_copy(copier, content_creator, run_options, credentials, logger, failures):
+def each_destination(logger, destinations):
+    """ Yields the destinations, logging which one the next steps are for when there are several. """
+    for destination in destinations:
+        if len(destinations) > 1:
+            logger.info("-------- Destination %s: %s --------" % (destination.copy_config.name,
+                                                              destination.copy_config.destination_server))
+        yield destination
+
+
+def publish_modules_post_copy(copy_map, content_creator, run_options, credentials, logger, failures, progress=None):
     """
     Publishes modules that has been copied to the destination server.
 
     Arguments:
-        copier - the copier object that did the copying
+        copy_map - the bookmap data of the modules that were copied
         content_creator - the creator object to do the publishing
         run_options - the input running options, what will the tool do
         credentials - the user's credentials
         logger - the tool's logger
         failures - the working list of failures
+        progress - (optional) the progress reporter
 
     Returns:
         None
     """
-    for module in copier.copy_map.modules:
+    import lib.tracing as tracing
+    if progress:
+        progress.start_phase('publish', len([module for module in copy_map.modules
+                                             if module.valid and module.chapter_number in run_options.chapters]))
+    for module in copy_map.modules:
         if module.valid and module.chapter_number in run_options.chapters:
             logger.info("Publishing module: %s - %s" % (module.destination_id, module.full_title()))
             if not run_options.dryrun:
                 try:
-                    content_creator.publish_module("%s/%s/" % (module.destination_workspace_url, module.destination_id),
-                                                   credentials, logger, False)
+                    with tracing.span('publish', module=module.destination_id):
+                        content_creator.publish_module("%s/%s/" % (module.destination_workspace_url,
+                                                                   module.destination_id),
+                                                       credentials, logger, False)
                 except util.TerminateError:
                     raise util.TerminateError("Terminate Signaled")
                 except (CCTError, Exception) as e:
@@ -340,6 +564,39 @@ def publish_modules_post_copy(copier, content_creator, run_options, credentials,
                     logger.error("Failed to publish module %s", module.destination_id)
                     module.valid = False
                     failures.append((module.full_title(), "publishing module"))
+            if progress:
+                progress.module_done(module.valid)
+    if progress:
+        progress.finish_phase()
+
+
+def validate_input(logger, bookmap, copy_config, run_options, failures, source=None):
+    """
+    Checks every selected module of the bookmap before any request is made,
+    logs the problems and, when there are problems or warnings, writes them to
+    a json report. Modules with problems are marked invalid, so the run leaves
+    them out.
+
+    Returns:
+        The number of modules with problems.
+    """
+    import lib.validation as validation
+    start = time.time()
+    problems, warnings = validation.validate(bookmap, copy_config, run_options, source)
+    report = None
+    if problems or warnings:
+        report = validation.write_report(bookmap, problems, warnings, time.time() - start)
+    for module, problem in problems:
+        logger.warn("\033[91mChapter %s, module [%s]: %s\033[0m" % (module.chapter_number, module.title, problem))
+        if module.valid:
+            module.valid = False
+            failures.append((module.full_title(), "validating module (%s)" % problem))
+    for module, warning in warnings:
+        logger.warn("Chapter %s, module [%s]: %s" % (module.chapter_number, module.title, warning))
+    invalid = len(set(id(module) for module, problem in problems))
+    logger.info("Validated the input in %.3fs, \033[95m%d\033[0m modules with problems%s" %
+                (time.time() - start, invalid, ", report: %s" % report if report else ""))
+    return invalid
 
 
 def print_failures(logger, failures):
@@ -347,22 +604,35 @@ def print_failures(logger, failures):
         logger.error("\033[95mFailed %s - \033[91m%s\033[0m", failure[1], failure[0])
 
 
-def user_confirm(logger, copy_config, bookmap, run_options, role_config):
+def user_confirm(logger, copy_config, bookmap, run_options, role_config, problems=0, destinations=(), preflight=None,
+                 size_cache=None, prefetch=None):
     """
     Prints a summary of the settings for the process that is about to run and
-    asks for user confirmation.
+    asks for user confirmation. The preflight check and the prefetch (if given)
+    run while the user reads the summary; when the preflight check leaves
+    modules out the user confirms again, when the user cancels the prefetched
+    files are discarded.
     """
+    import lib.bandwidth as bandwidth
     logger.info("-------- Summary ---------------------------------------")
-    if run_options.copy:  # confirm each entry in the bookmap has a source module ID.
-        last_title = "!ITS THE FIRST ONE!"
-        for module in bookmap.bookmap.modules:
-            if module.chapter_number in bookmap.chapters and (module.source_id is '' or module.source_id is ' ' or
-                                                              module.source_id is None):
-                logger.warn("\033[91mInput file has missing source module ID for module [%s]"
-                            "- the module after [%s].\033[0m" % (module.title, last_title))
-            last_title = module.title
-    logger.info("Source: \033[95m%s\033[0m" % copy_config.source_server)
-    logger.info("Destination: \033[95m%s\033[0m" % copy_config.destination_server)
+    if problems:
+        logger.warn("\033[91m%d modules have problems in the input file and will be skipped, see the validation "
+                    "report.\033[0m" % problems)
+    if run_options.import_bundle:
+        logger.info("Source: \033[95mbundle %s\033[0m" % run_options.import_bundle)
+    else:
+        logger.info("Source: \033[95m%s\033[0m" % copy_config.source_server)
+    if run_options.source_collection:
+        logger.info("Module exports from the complete export of collection: \033[95m%s\033[0m" %
+                    run_options.source_collection)
+    if run_options.export_bundle:
+        logger.info("Export to bundle: \033[95m%s\033[0m" % run_options.export_bundle)
+    if len(destinations) > 1:
+        for destination in destinations:
+            logger.info("Destination %s: \033[95m%s\033[0m" % (destination.copy_config.name,
+                                                                destination.copy_config.destination_server))
+    else:
+        logger.info("Destination: \033[95m%s\033[0m" % copy_config.destination_server)
     if PRODUCTION:
         logger.info("User: \033[95m%s\033[0m" % copy_config.credentials.split(':')[0])
     else:
@@ -377,6 +647,17 @@ def user_confirm(logger, copy_config, bookmap, run_options, role_config):
     logger.info("Copy content? \033[95m%s\033[0m" % run_options.copy)
     if run_options.copy:
         logger.info("Edit roles? \033[95m%s\033[0m" % run_options.roles)
+        if run_options.roles and copy_config.synthesize_receipts:
+            logger.info("Deposit receipts written locally (without the editors, translators, licensors and "
+                        "derived-from of the source modules): \033[95mTrue\033[0m")
+        logger.info("Upload encoding: \033[95m%s\033[0m" % copy_config.upload_encoding)
+        if bandwidth.governor:
+            logger.info("Bandwidth limits: \033[95m%s\033[0m" % ', '.join(
+                "%s %s" % (host, ' '.join("%s %.0f KB/s" % (direction, rate / 1024)
+                                          for direction, rate in sorted(rates.iteritems())))
+                for host, rates in sorted(bandwidth.governor.limits.iteritems())))
+        if copy_config.copy_workers > 1:
+            logger.info("Copy workers (largest modules first): \033[95m%s\033[0m" % copy_config.copy_workers)
     if run_options.accept_roles:
         logger.info("Accept roles? \033[95m%s\033[0m" % run_options.accept_roles)
     if run_options.roles or run_options.accept_roles:
@@ -387,9 +668,23 @@ def user_confirm(logger, copy_config, bookmap, run_options, role_config):
     if run_options.collections:
         logger.info("Units? \033[95m%s\033[0m" % run_options.units)
     logger.info("Publish content? \033[95m%s\033[0m" % run_options.publish)
+    logger.info("Verify copied content? \033[95m%s\033[0m" % bool(run_options.verify))
+    if prefetch:
+        logger.info("Downloading the first \033[95m%d\033[0m modules while you read this" % len(prefetch.source_ids))
     if run_options.dryrun:
         logger.info("------------NOTE: \033[95mDRY RUN\033[0m-----------------")
 
+    ask_to_proceed([task for task in (preflight, prefetch) if task is not None])
+    if preflight is not None:
+        logger.info("Waiting for the preflight check of %d modules..." % len(preflight.probes))
+        if preflight.finish(logger, size_cache):
+            ask_to_proceed([prefetch] if prefetch else [])
+    if prefetch:
+        logger.debug("%d files were prefetched before the run was confirmed" % prefetch.prefetched())
+
+
+def ask_to_proceed(tasks=()):
+    """ Returns when the user enters 1, exits when they enter 2 (cancelling the background tasks). """
     while True:
         var = raw_input("\33[95mPlease verify this information. If there are \033[91mwarnings\033[95m, "
                         "consider checking your data.\n"
@@ -399,6 +694,8 @@ def user_confirm(logger, copy_config, bookmap, run_options, role_config):
         if var is '1':
             break
         elif var is '2':
+            for task in tasks:
+                task.cancel()
             sys.exit()
 
 
@@ -408,9 +705,15 @@ def main():
 
     if args.chapters:
         args.chapters.sort()
+    from lib.operation_objects import RunOptions
     run_options = RunOptions(args.modules, args.workgroups, args.copy, args.roles, args.accept_roles, args.collection,
                              args.units, args.publish, args.publish_collection, args.chapters, args.exclude,
-                             args.dryrun)
+                             args.dryrun, profile=args.profile, record=args.record, replay=args.replay,
+                             replay_speed=args.replay_speed, metrics_port=args.metrics_port,
+                             metrics_file=args.metrics_file, verify=args.verify,
+                             trace=args.trace,
+                             export_bundle=args.export_bundle, import_bundle=args.import_bundle,
+                             memory=args.memory, source_collection=args.source_collection)
     booktitle = ""
     signal.signal(signal.SIGINT, util.handle_terminate)
     signal.signal(signal.SIGTSTP, util.handle_user_skip)
@@ -0,0 +1,147 @@
+import threading
+import time
+from urlparse import urlparse
+
+"""
+This file contains the bandwidth governor of the content-copy-tool.
+
+With the bandwidth_limits setting, the module downloads and uploads to a
+server are held to an upload and a download rate (bytes per second) by a token
+bucket per server and direction. The buckets are shared by all the workers,
+so the limit is the limit of the whole tool, not of each worker.
+
+The small control requests (wizard, publish, composer, ...) are never made to
+wait for the buckets, they take their bytes out of the buckets when they
+finish. While one of them runs, the bulk transfers to its server are held to
+a part of the limit, so a wizard POST does not queue behind the module zips.
+"""
+
+governor = None  # a Governor when limits are set
+BULK = ('DOWNLOAD', 'UPLOAD')  # the http_util request kinds that move module files
+CONTROL_SHARE = 0.5  # the part of the limit left to control requests while they run
+MAX_WAIT = 0.5  # a transfer that waits for tokens checks again at least this often
+
+
+class TokenBucket:
+    """ Holds the transfers that take from it to [rate] bytes per second, with bursts of up to a second. """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.capacity = self.rate
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.control = 0  # control requests running
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, size):
+        """ Waits until the bulk transfer may move [size] more bytes. """
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens > 0:
+                    # larger takes leave the bucket in debt, which the next takes wait for
+                    self.tokens -= size / (1 - CONTROL_SHARE) if self.control else size
+                    return
+                wait = -self.tokens / self.rate
+            time.sleep(min(max(wait, 0.001), MAX_WAIT))
+
+    def charge(self, size):
+        """ Takes the bytes of a control request, without waiting. """
+        with self.lock:
+            self.refill()
+            self.tokens -= size
+
+
+class Governor:
+    """
+    The token buckets of the servers. limits maps a host name (or '*' for the
+    other hosts) to its 'upload' and 'download' rates in bytes per second, a
+    rate a host does not have is the rate of '*'.
+    """
+    def __init__(self, limits):
+        self.limits = limits
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url, direction):
+        """ Returns the bucket of the host of url for direction, or None if it is not limited. """
+        host = urlparse(url).hostname or ''
+        with self.lock:
+            if (host, direction) not in self.buckets:
+                rate = self.limits.get(host, {}).get(direction) or self.limits.get('*', {}).get(direction)
+                self.buckets[(host, direction)] = TokenBucket(rate) if rate else None
+            return self.buckets[(host, direction)]
+
+    def take(self, url, direction, size):
+        bucket = self.bucket(url, direction)
+        if bucket is not None:
+            bucket.take(size)
+
+    def control_buckets(self, kind, url):
+        if kind in BULK or url is None:
+            return []
+        return [bucket for bucket in (self.bucket(url, 'download'), self.bucket(url, 'upload')) if bucket is not None]
+
+    def request_started(self, kind, url):
+        for bucket in self.control_buckets(kind, url):
+            with bucket.lock:
+                bucket.control += 1
+
+    def request_finished(self, kind, url, status, bytes_down, bytes_up, elapsed):
+        for bucket in self.control_buckets(kind, url):
+            with bucket.lock:
+                bucket.control -= 1
+        if kind not in BULK and url is not None:
+            self.charge(url, 'download', bytes_down)
+            self.charge(url, 'upload', bytes_up)
+
+    def charge(self, url, direction, size):
+        bucket = self.bucket(url, direction)
+        if bucket is not None and size:
+            bucket.charge(size)
+
+
+class ThrottledFile:
+    """ A file to upload whose reads wait for the upload bucket of url, for httplib. """
+    def __init__(self, file_object, url):
+        self.file_object = file_object
+        self.url = url
+
+    def read(self, size=-1):
+        data = self.file_object.read(size)
+        if data:
+            take(self.url, 'upload', len(data))
+        return data
+
+    def fileno(self):
+        return self.file_object.fileno()  # httplib sets the Content-Length from the size of the file
+
+
+def take(url, direction, size):
+    """ Waits until [size] more bytes may be moved in direction ('upload' or 'download') to the host of url. """
+    if governor is not None:
+        governor.take(url, direction, size)
+
+
+def throttled(file_object, url):
+    """ Returns the file to upload to url, throttled when there are limits. """
+    if governor is None:
+        return file_object
+    return ThrottledFile(file_object, url)
+
+
+def parse_limits(settings):
+    """
+    Returns the limits of a Governor from the bandwidth_limits setting, which
+    maps host names (or '*') to "upload_kb" and "download_kb" rates in KB per
+    second.
+    """
+    limits = {}
+    for host, rates in settings.iteritems():
+        limits[host] = dict((direction, float(rates["%s_kb" % direction]) * 1024)
+                            for direction in ('upload', 'download') if rates.get("%s_kb" % direction))
+    return limits
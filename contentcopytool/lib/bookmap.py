@@ -33,8 +33,9 @@ class BookmapConfiguration:
 
 class Bookmap:
     """ Represents the input data plus the input options """
-    def __init__(self, filename, bookmap_config, run_options, logger):
+    def __init__(self, filename, bookmap_config, run_options, logger, name=None):
         self.filename = filename
+        self.name = name  # the destination the bookmap is read for, it is added to the name of the output file
         self.config = bookmap_config
         self.booktitle = self.parse_book_title(filename)
         self.delimiter = ','
@@ -174,6 +175,8 @@ class Bookmap:
 
         file_root, file_ext = path.splitext(self.filename)
         file_desc = 'error' if error else 'output'
+        if self.name:
+            file_desc = "%s_%s" % (self.name, file_desc)
         save_file = "%s_%s_%s%s" % (file_root, file_desc, time.strftime("%Y%m%d-%H%M%S"), file_ext)
 
         columns = [self.config.chapter_number_column,
@@ -0,0 +1,187 @@
+import json
+import os
+import struct
+import threading
+import time
+import traceback
+import zlib
+from util import CCTError, TerminateError
+
+"""
+This file contains the book bundles of the content-copy-tool.
+
+A bundle holds the export zip and the deposit receipt of every module of a
+book in one file, so the source server is only needed while the bundle is
+exported (--export-bundle) and the modules can be copied from the bundle
+later (--import-bundle), when the destination server is available.
+
+The file is the magic line, the files one after the other, a json manifest
+with the offset, size and crc32 of each file, and a trailer with the offset of
+the manifest, so any file can be read without reading the ones before it.
+"""
+
+MAGIC = 'CCT-BUNDLE-1\n'
+TRAILER = struct.Struct('>Q12s')  # offset of the manifest, end marker
+END = 'CCT-BUNDLE-E'
+BUFFER_SIZE = 64 * 1024
+
+
+class BundleWriter:
+    """ Writes a bundle. The file only gets its name when it is closed, so a failed export leaves no bundle. """
+    def __init__(self, filename):
+        self.filename = filename
+        self.bundle_file = open("%s.part" % filename, 'wb')
+        self.bundle_file.write(MAGIC)
+        self.entries = {}
+
+    def add(self, name, filename):
+        """ Appends the file to the bundle as [name]. """
+        offset = self.bundle_file.tell()
+        crc = 0
+        with open(filename, 'rb') as input_file:
+            while True:
+                data = input_file.read(BUFFER_SIZE)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                self.bundle_file.write(data)
+        self.entries[name] = {'offset': offset, 'size': self.bundle_file.tell() - offset, 'crc32': crc & 0xffffffff}
+
+    def close(self, metadata):
+        """ Writes the manifest with the metadata and gives the bundle its name. """
+        manifest_offset = self.bundle_file.tell()
+        json.dump({'metadata': metadata, 'entries': self.entries}, self.bundle_file, sort_keys=True)
+        self.bundle_file.write(TRAILER.pack(manifest_offset, END))
+        self.bundle_file.close()
+        os.rename("%s.part" % self.filename, self.filename)
+
+    def abort(self):
+        self.bundle_file.close()
+        os.remove("%s.part" % self.filename)
+
+
+class BundleReader:
+    """ Reads the files of a bundle. Each read opens the file, so workers can read at the same time. """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as bundle_file:
+            if bundle_file.read(len(MAGIC)) != MAGIC:
+                raise CCTError("%s is not a content copy bundle" % filename)
+            bundle_file.seek(-TRAILER.size, os.SEEK_END)
+            manifest_offset, end = TRAILER.unpack(bundle_file.read(TRAILER.size))
+            if end != END:
+                raise CCTError("The bundle %s is incomplete" % filename)
+            bundle_file.seek(manifest_offset)
+            manifest = json.loads(bundle_file.read()[:-TRAILER.size])
+        self.metadata = manifest['metadata']
+        self.entries = dict((name.encode('UTF-8'), entry) for name, entry in manifest['entries'].iteritems())
+
+    def has(self, name):
+        return name in self.entries
+
+    def size(self, name):
+        return self.entries[name]['size']
+
+    def extract(self, name, filename):
+        """ Writes the file [name] of the bundle to filename. """
+        if name not in self.entries:
+            raise CCTError("%s is not in the bundle %s" % (name, self.filename))
+        entry = self.entries[name]
+        remaining = entry['size']
+        crc = 0
+        with open(self.filename, 'rb') as bundle_file:
+            bundle_file.seek(entry['offset'])
+            with open(filename, 'wb') as output_file:
+                while remaining > 0:
+                    data = bundle_file.read(min(BUFFER_SIZE, remaining))
+                    if not data:
+                        break
+                    crc = zlib.crc32(data, crc)
+                    output_file.write(data)
+                    remaining -= len(data)
+        if remaining or crc & 0xffffffff != entry['crc32']:
+            os.remove(filename)
+            raise CCTError("%s is damaged in the bundle %s" % (name, self.filename))
+        return filename
+
+
+class BundleSource:
+    """ The source of the module exports and receipts in a bundle, used by the copier instead of the server. """
+    def __init__(self, reader):
+        self.reader = reader
+
+    def has(self, source_id):
+        return self.reader.has("%s.zip" % source_id)
+
+    def download_export(self, source_id):
+        return self.reader.extract("%s.zip" % source_id, "%s.zip" % source_id)
+
+    def download_receipt(self, source_id):
+        return self.reader.extract("%s.xml" % source_id, "%s.xml" % source_id)
+
+    def export_sizes(self, modules, cache, workers):
+        return dict((module.source_id, self.reader.size("%s.zip" % module.source_id))
+                    for module in modules if self.has(module.source_id))
+
+
+def export_modules(source, modules, filename, metadata, workers, logger, failures, progress=None):
+    """
+    Downloads the export zip and receipt of each module from the source and
+    writes them to the bundle filename, [workers] modules at a time.
+
+    Returns:
+        The number of modules in the bundle.
+    """
+    from multiprocessing.pool import ThreadPool
+    source_ids = []
+    for module in modules:
+        if module.source_id not in source_ids:
+            source_ids.append(module.source_id)
+    titles = dict((module.source_id, module.full_title()) for module in modules)
+    if progress:
+        progress.start_phase('export', len(source_ids))
+    lock = threading.Lock()  # the pool threads download, the bundle is written by one of them at a time
+    writer = BundleWriter(filename)
+
+    def export(source_id):
+        try:
+            files = [source.download_export(source_id), source.download_receipt(source_id)]
+            with lock:
+                writer.add("%s.zip" % source_id, files[0])
+                writer.add("%s.xml" % source_id, files[1])
+            for temp_file in files:
+                os.remove(temp_file)
+            return source_id, None
+        except TerminateError:
+            raise
+        except Exception as e:
+            return source_id, (e, traceback.format_exc())
+
+    pool = ThreadPool(max(workers, 1))
+    results = [pool.apply_async(export, (source_id,)) for source_id in source_ids]
+    pool.close()
+    exported = 0
+    try:
+        for result in results:
+            while not result.ready():
+                result.wait(0.5)  # a timed wait lets the signal handlers of the main thread run
+            source_id, error = result.get()
+            if error is None:
+                logger.info("Exported module %s - %s" % (source_id, titles[source_id]))
+                exported += 1
+            else:
+                logger.debug(error[1])
+                logger.error("Failure exporting module %s: %s" % (source_id, getattr(error[0], 'msg', error[0])))
+                failures.append((titles[source_id], " exporting module"))
+            if progress:
+                progress.module_done(error is None)
+    except TerminateError:
+        pool.terminate()
+        writer.abort()
+        raise
+    pool.join()
+    metadata = dict(metadata, created=time.strftime('%Y-%m-%dT%H:%M:%S'), modules=exported)
+    writer.close(metadata)
+    if progress:
+        progress.finish_phase()
+    return exported
@@ -0,0 +1,185 @@
+import codecs
+import json
+import threading
+import time
+from base64 import b64decode, b64encode
+from os import path
+from urlparse import parse_qsl, urlparse, urlunparse
+
+from util import CCTError
+
+"""
+This file contains the record/replay support for the HTTP layer.
+
+In record mode every request made through http_util is written to a cassette
+file together with its response and the time it took. In replay mode the
+responses are served from the cassette instead of the network, optionally
+sleeping for the recorded time (scaled by the replay speed), so the same
+workload can be run through content_copy.run repeatedly without live servers.
+
+The cassette is a json-lines file, one recorded interaction per line.
+"""
+
+VOLATILE_PARAMETERS = ['nonce']  # query parameters that change between runs
+
+
+def normalize_url(url):
+    """ Returns the url without the query parameters that differ from run to run. """
+    from urllib import urlencode
+    parsed = urlparse(url)
+    query = [(key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+             if key not in VOLATILE_PARAMETERS]
+    return urlunparse(parsed._replace(query=urlencode(sorted(query))))
+
+
+class Cassette:
+    """ Records interactions to, or replays them from, a cassette file. """
+    def __init__(self, filename, mode, speed=1.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError("Unknown cassette mode: %s" % mode)
+        self.filename = filename
+        self.mode = mode
+        self.speed = speed
+        self.recorded = 0
+        self.replayed = 0
+        self.interactions = {}
+        self.lock = threading.Lock()
+        if mode == 'record':
+            self.file = open(filename, 'w')
+        else:
+            self.file = None
+            with open(filename) as cassette_file:
+                for line in cassette_file:
+                    if line.strip():
+                        interaction = json.loads(line)
+                        key = (interaction['method'], interaction['url'])
+                        self.interactions.setdefault(key, []).append(interaction)
+                        self.recorded += 1
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def summary(self):
+        if self.replaying:
+            return "Replayed %d of %d recorded requests from %s" % (self.replayed, self.recorded, self.filename)
+        return "Recorded %d requests to %s" % (self.recorded, self.filename)
+
+    def write(self, method, url, elapsed, status, reason, body='', **extra):
+        interaction = {'method': method,
+                       'url': normalize_url(url),
+                       'elapsed': elapsed,
+                       'status': status,
+                       'reason': reason,
+                       'body': b64encode(body)}
+        interaction.update(extra)
+        with self.lock:
+            self.file.write(json.dumps(interaction) + '\n')
+            self.file.flush()
+            self.recorded += 1
+
+    def record_response(self, method, url, response, elapsed):
+        """ Records a requests response. """
+        self.write(method, url, elapsed, response.status_code, response.reason, response.content,
+                   final_url=response.url,
+                   headers=dict(response.headers),
+                   encoding=response.encoding,
+                   is_redirect=response.is_redirect,
+                   is_permanent_redirect=response.is_permanent_redirect,
+                   request_method=response.request.method)
+
+    def record_download(self, url, filename, elapsed):
+        """ Records a file download (a failed download is recorded with an empty body). """
+        if not path.exists(filename):
+            self.write('DOWNLOAD', url, elapsed, 200, 'OK')
+            return
+        with open(filename, 'rb') as downloaded:
+            self.write('DOWNLOAD', url, elapsed, 200, 'OK', downloaded.read())
+
+    def record_upload(self, url, response, elapsed):
+        """ Records the response of a multipart upload (the upload body is not recorded). """
+        self.write('UPLOAD', url, elapsed, response.status, response.reason)
+
+    def next_interaction(self, method, url):
+        with self.lock:
+            interactions = self.interactions.get((method, normalize_url(url)))
+            if not interactions:
+                raise CCTError("No recorded response for %s %s in %s" % (method, url, self.filename))
+            interaction = interactions.pop(0)
+            self.replayed += 1
+        if self.speed:
+            time.sleep(interaction['elapsed'] / self.speed)
+        return interaction
+
+    def replay_response(self, method, url):
+        """ Returns a requests-like response for the next recorded request to url. """
+        return ReplayedResponse(method, url, self.next_interaction(method, url))
+
+    def replay_download(self, url, filename):
+        """ Writes the next recorded download of url to filename. """
+        with open(filename, 'wb') as downloaded:
+            downloaded.write(b64decode(self.next_interaction('DOWNLOAD', url)['body']))
+
+    def replay_upload(self, url):
+        """ Returns an httplib-like response for the next recorded upload to url. """
+        return ReplayedUploadResponse(self.next_interaction('UPLOAD', url))
+
+
+class ReplayedRequest:
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+        self.body = None
+
+
+class ReplayedResponse:
+    """ Stands in for a requests.Response. """
+    def __init__(self, method, url, interaction):
+        self.status_code = interaction['status']
+        self.reason = interaction['reason']
+        self.url = interaction.get('final_url', url)
+        self.headers = CaseInsensitiveHeaders((key.lower(), value)
+                                              for key, value in interaction.get('headers', {}).iteritems())
+        self.encoding = interaction.get('encoding')
+        self.is_redirect = interaction.get('is_redirect', False)
+        self.is_permanent_redirect = interaction.get('is_permanent_redirect', False)
+        self.request = ReplayedRequest(interaction.get('request_method', method), url)
+        self.content = b64decode(interaction['body'])
+        self.elapsed = interaction['elapsed']
+
+    @property
+    def text(self):
+        return codecs.decode(self.content, self.encoding or 'utf-8', 'replace')
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class ReplayedUploadResponse:
+    """ Stands in for an httplib.HTTPResponse. """
+    def __init__(self, interaction):
+        self.status = interaction['status']
+        self.reason = interaction['reason']
+
+    def read(self):
+        return ''
+
+
+class CaseInsensitiveHeaders(dict):
+    def __getitem__(self, key):
+        return dict.__getitem__(self, key.lower())
+
+    def get(self, key, default=None):
+        return dict.get(self, key.lower(), default)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key.lower())
@@ -0,0 +1,157 @@
+import re as regex
+import shutil
+import threading
+from os import path
+from tempfile import mkdtemp
+
+"""
+This file contains the collection export source of the content-copy-tool.
+
+With --source-collection, the complete zip of the source collection is
+downloaded in one request the first time a module export is needed, instead
+of one module export request per module. The export of each module is then
+written from the files of its directory in the collection zip, one file at a
+time, and goes through the copier (clean, roles, upload) as usual. Modules
+that are not in the collection zip, and all the modules if the collection
+zip cannot be downloaded, are exported from the source server one by one.
+
+The collection zip is not the same as the module exports in two ways, which
+are checked for each module. A collection can pin a module to a version
+other than its latest, which is what the module export has: such modules
+(and all the modules, if the collection.xml cannot be read) are exported one
+by one. The module directories also hold files that the collection export
+generates (COLLECTION_FILES), which are left out.
+"""
+
+MODULE_DIRECTORY = regex.compile(r'^m\d+$')
+COLLECTION_FILES = ('index_auto_generated.cnxml',)
+COLLXML = 'http://cnx.rice.edu/collxml'
+
+
+def latest_modules(collection):
+    """
+    Returns the ids of the modules the collection.xml of the collection zip
+    includes at their latest version, or None if it cannot be read.
+    """
+    from xml.etree import cElementTree
+    names = [name for name in collection.namelist() if regex.match(r'^([^/]*/)?collection\.xml$', name)]
+    if not names:
+        return None
+    try:
+        root = cElementTree.fromstring(collection.read(names[0]))
+    except SyntaxError:  # cElementTree.ParseError
+        return None
+    return set(element.get('document') for element in root.iter('{%s}module' % COLLXML)
+               if element.get('version') == 'latest')
+
+
+def module_files(zipfilename):
+    """
+    Returns a dictionary mapping the ids of the modules in the collection zip
+    that are the same as their module export (see above) to the entries in
+    their directory, and the number of modules that are not.
+    """
+    import zipfile
+    modules = {}
+    with zipfile.ZipFile(zipfilename, 'r') as collection:
+        latest = latest_modules(collection)
+        for info in collection.infolist():
+            parts = info.filename.split('/')
+            for index, part in enumerate(parts[:-1]):
+                if MODULE_DIRECTORY.match(part):
+                    if parts[-1] and parts[-1] not in COLLECTION_FILES:  # not the directory itself
+                        modules.setdefault(part, []).append((info.filename, '/'.join(parts[index + 1:])))
+                    break
+    other = [module_id for module_id in modules if latest is None or module_id not in latest]
+    for module_id in other:
+        del modules[module_id]
+    return modules, len(other)
+
+
+def write_module_zip(zipfilename, module_id, entries, filename, workdir):
+    """
+    Writes the entries of the module in the collection zip as the module
+    export filename (the files in a [module_id] directory). Each file is
+    copied through workdir, so no file is held in memory.
+    """
+    import zipfile
+    with zipfile.ZipFile(zipfilename, 'r') as collection:
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as module_zip:
+            for name, relative_name in entries:
+                temp_file = path.join(workdir, "%s.part" % module_id)
+                with collection.open(name) as member:
+                    with open(temp_file, 'wb') as output:
+                        shutil.copyfileobj(member, output, 64 * 1024)
+                module_zip.write(temp_file, "%s/%s" % (module_id, relative_name))
+    return filename
+
+
+class CollectionExportSource:
+    """ Stands in for a LiveSource, with the module exports taken from the complete zip of a collection. """
+    def __init__(self, source, collection_id, logger):
+        self.source = source
+        self.source_server = source.source_server
+        self.collection_id = collection_id
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.directory = None
+        self.zipfilename = None
+        self.modules = None  # module id -> entries, once the collection zip is downloaded
+
+    def url(self):
+        return "%s/content/%s/latest/complete" % (self.source_server, self.collection_id)
+
+    def fetch(self):
+        """ Downloads and indexes the collection zip, once. Returns the index (empty if it failed). """
+        import zipfile
+        import http_util as http
+        from util import TerminateError
+        with self.lock:
+            if self.modules is None:
+                try:
+                    self.directory = mkdtemp('.collection', '.cct', '.')
+                    self.logger.info("Downloading the complete export of collection %s" % self.collection_id)
+                    self.zipfilename = http.http_download_file(self.url(),
+                                                               path.join(self.directory, self.collection_id), '.zip')
+                    if path.exists(self.zipfilename) and zipfile.is_zipfile(self.zipfilename):
+                        self.modules, other = module_files(self.zipfilename)
+                        self.logger.info("Collection %s has \033[95m%d\033[0m modules as in their latest export, "
+                                         "%d other modules are exported one by one" %
+                                         (self.collection_id, len(self.modules), other))
+                except TerminateError:
+                    raise
+                except Exception as e:
+                    self.logger.debug("Downloading collection %s failed: %s" % (self.collection_id, e))
+                finally:
+                    if self.modules is None:
+                        self.logger.warn("\033[91mThe complete export of collection %s could not be downloaded, "
+                                         "the modules are exported one by one\033[0m" % self.collection_id)
+                        self.modules = {}
+            return self.modules
+
+    def has(self, source_id):
+        return self.source.has(source_id)
+
+    def export_sizes(self, modules, cache, workers):
+        return self.source.export_sizes(modules, cache, workers)
+
+    def download_export(self, source_id):
+        entries = self.fetch().get(source_id)
+        if not entries:
+            return self.source.download_export(source_id)
+        workdir = mkdtemp('.module', '.cct', self.directory)  # each worker copies the files in a directory of its own
+        try:
+            return write_module_zip(self.zipfilename, source_id, entries, "%s.zip" % source_id, workdir)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def download_receipt(self, source_id):
+        return self.source.download_receipt(source_id)  # the deposit receipts are not in the collection zip
+
+    def close(self):
+        """ Removes the collection zip. """
+        with self.lock:
+            if self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+                self.directory = None
+            self.modules = {}  # any later export is made by the source server
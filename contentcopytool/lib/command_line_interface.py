@@ -84,6 +84,49 @@ def get_parser(version):
     control_args.add_argument("--dry-run", action="store_true", dest="dryrun",
                               help="Steps through input processing, but does NOT create or copy any content. "
                                    "This is used for checking input file correctness (optional).")
+    control_args.add_argument("--profile", action="store", dest="profile", nargs="?", const="profile",
+                              metavar="DIR",
+                              help="Profile the CPU time of each phase of the run and write the stats and "
+                                   "collapsed stacks (for flame graphs) to DIR, default: profile (optional).")
+    control_args.add_argument("--record", action="store", dest="record", metavar="CASSETTE",
+                              help="Record every HTTP request and response of the run, with its timing, to the "
+                                   "CASSETTE file (optional).")
+    control_args.add_argument("--replay", action="store", dest="replay", metavar="CASSETTE",
+                              help="Serve the HTTP responses from a recorded CASSETTE file instead of the servers "
+                                   "(optional).")
+    control_args.add_argument("--replay-speed", action="store", dest="replay_speed", type=float, default=1.0,
+                              metavar="FACTOR",
+                              help="With --replay, wait the recorded time of each request divided by FACTOR, 0 "
+                                   "does not wait at all, default: 1 (optional).")
+    control_args.add_argument("--metrics-port", action="store", dest="metrics_port", type=int, metavar="PORT",
+                              help="Serve metrics of the run in the Prometheus format on "
+                                   "http://127.0.0.1:PORT/metrics (optional).")
+    control_args.add_argument("--metrics-file", action="store", dest="metrics_file", metavar="FILE",
+                              help="Rewrite FILE with the metrics of the run in the Prometheus format every 15 "
+                                   "seconds (optional).")
+    control_args.add_argument("--trace", action="store", dest="trace", metavar="FILE",
+                              help="Record the steps of each module (downloads, role rewrite, zip clean, "
+                                   "multipart build, upload, publish, collection add) and every request as spans, "
+                                   "and write them to FILE in the Chrome trace format (optional).")
+    control_args.add_argument("--export-bundle", action="store", dest="export_bundle", metavar="BUNDLE",
+                              help="Only download the export and deposit receipt of each module from the source "
+                                   "server into the BUNDLE file, to be copied later with --import-bundle.")
+    control_args.add_argument("--import-bundle", action="store", dest="import_bundle", metavar="BUNDLE",
+                              help="With -c, --copy, copy the modules from the BUNDLE file written by "
+                                   "--export-bundle instead of the source server.")
+    control_args.add_argument("--source-collection", action="store", dest="source_collection",
+                              metavar="COLLECTION_ID",
+                              help="Download the complete export of the source collection COLLECTION_ID in one "
+                                   "request and take the module exports from it, modules that are not in it are "
+                                   "exported one by one (optional).")
+    control_args.add_argument("--memory", action="store_true", dest="memory",
+                              help="Report the peak memory of each phase and of the modules that used the most, "
+                                   "with the object types that grew the most in each phase; the peaks of the "
+                                   "modules are only their own with one copy worker (optional).")
+    control_args.add_argument("--verify", action="store_true", dest="verify",
+                              help="After the run, export each destination module again and compare its files "
+                                   "with the source export by the checksums in the zip directory, reporting the "
+                                   "modules and files that differ (optional).")
 
     parser.add_argument("--version", action="version", version=version, help="Prints the tool's version")
 
@@ -99,3 +142,25 @@ def verify_args(args):
     if args.publish_collection and not args.collection:
         print "ERROR: using --publish-collection requires the use of -o, --collection."
         sys.exit()
+    if args.record and args.replay:
+        print "ERROR: --record and --replay cannot be used together."
+        sys.exit()
+    if args.export_bundle and (args.modules or args.workgroups or args.copy or args.collection or args.publish or
+                               args.accept_roles or args.verify):
+        print "ERROR: --export-bundle cannot be used with operations on the destination server."
+        sys.exit()
+    if args.export_bundle and args.import_bundle:
+        print "ERROR: --export-bundle and --import-bundle cannot be used together."
+        sys.exit()
+    if args.import_bundle and not args.copy:
+        print "ERROR: using --import-bundle requires the use of -c, --copy."
+        sys.exit()
+    if args.source_collection and args.import_bundle:
+        print "ERROR: --source-collection and --import-bundle cannot be used together."
+        sys.exit()
+    if args.source_collection and not (args.copy or args.export_bundle):
+        print "ERROR: using --source-collection requires the use of -c, --copy or --export-bundle."
+        sys.exit()
+    if args.replay_speed < 0:
+        print "ERROR: --replay-speed must not be negative."
+        sys.exit()
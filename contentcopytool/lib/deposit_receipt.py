@@ -0,0 +1,131 @@
+import re as regex
+import time
+
+"""
+This file contains the local deposit receipts of the content-copy-tool.
+
+The atom entry that is sent with a module zip is normally the deposit receipt
+of the module on the source server, with the roles rewritten. When the roles
+are overridden from the settings anyway (--roles), the entry can be written
+here from the metadata in the index.cnxml of the export zip and the
+configured roles instead, which saves one request to the source server per
+module. Only the title, abstract, language, subjects, keywords, license and
+the configured roles are written: the other roles of the source module
+(editors, translators, licensors), what it is derived from and the other
+fields of the source receipt are not in the entry.
+"""
+
+MDML = 'http://cnx.rice.edu/mdml'
+
+TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<entry xmlns="http://www.w3.org/2005/Atom"
+       xmlns:sword="http://purl.org/net/sword/"
+       xmlns:dcterms="http://purl.org/dc/terms/"
+       xmlns:md="http://cnx.rice.edu/mdml"
+       xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+       xmlns:oerdc="http://cnx.org/aboutus/technology/schemas/oerdc">
+    <title>%(title)s</title>
+    <updated>%(updated)s</updated>
+    <summary type="text">%(abstract)s</summary>
+    <dcterms:title>%(title)s</dcterms:title>
+    <dcterms:abstract>%(abstract)s</dcterms:abstract>
+    <dcterms:language xsi:type="ISO639-1">%(language)s</dcterms:language>
+%(roles)s
+%(subjects)s
+%(keywords)s
+%(license)s
+</entry>
+"""
+
+
+def module_metadata(zipfilename):
+    """
+    Returns the metadata of the module in the export zip as a dictionary with
+    title, abstract, language, license (url), subjects, keywords and people
+    (user id -> display name and email, from the actors). Entries that are
+    not in the index.cnxml are left out.
+    """
+    import zipfile
+    from xml.etree import cElementTree
+    with zipfile.ZipFile(zipfilename, 'r') as zipf:
+        names = [name for name in zipf.namelist() if regex.match(r'^([^/]*/)?index\.cnxml$', name)]
+        if not names:
+            return {}
+        root = cElementTree.fromstring(zipf.read(names[0]))
+
+    def md(tag):
+        return '{%s}%s' % (MDML, tag)
+
+    def text(element):
+        return ' '.join(''.join(element.itertext()).split()).encode('UTF-8')  # collapse whitespace
+
+    metadata = {}
+    for tag in ('title', 'abstract', 'language'):
+        element = root.find('.//' + md(tag))
+        if element is not None and text(element):
+            metadata[tag] = text(element)
+    license_element = root.find('.//' + md('license'))
+    if license_element is not None:
+        url = license_element.get('url') or license_element.get('href') or text(license_element)
+        if url:
+            metadata['license'] = url.encode('UTF-8')
+    metadata['subjects'] = [text(element) for element in root.iter(md('subject')) if text(element)]
+    metadata['keywords'] = [text(element) for element in root.iter(md('keyword')) if text(element)]
+    people = {}
+    for tag in ('person', 'organization'):
+        for actor in root.iter(md(tag)):
+            fields = dict((field, text(actor.find(md(field)))) for field in ('fullname', 'firstname', 'surname',
+                                                                             'email')
+                          if actor.find(md(field)) is not None)
+            name = fields.get('fullname') or ' '.join(fields[field] for field in ('firstname', 'surname')
+                                                      if fields.get(field))
+            if actor.get('userid'):
+                people[actor.get('userid').encode('UTF-8')] = (name, fields.get('email'))
+    metadata['people'] = people
+    return metadata
+
+
+def role_elements(element, users, people):
+    """ Returns the elements of a role as in a deposit receipt, with the name and email of the users if known. """
+    from xml.sax.saxutils import escape, quoteattr  # saxutils imports urllib, which is slow to import
+    elements = []
+    for user in users:
+        name, email = people.get(user, (None, None))
+        elements.append('    <%s oerdc:id=%s%s oerdc:pending="False">%s</%s>' %
+                        (element, quoteattr(user), ' oerdc:email=%s' % quoteattr(email) if email else '',
+                         escape(name or user), element))
+    return '\n'.join(elements)
+
+
+def receipt(metadata, title, creators, maintainers, rightholders):
+    """ Returns the atom entry of the module, [title] is used when the metadata has none. """
+    from xml.sax.saxutils import escape
+    people = metadata.get('people', {})
+    roles = [role_elements('dcterms:creator', creators, people),
+             role_elements('oerdc:maintainer', maintainers, people),
+             role_elements('dcterms:rightsHolder', rightholders, people)]
+    subjects = ['    <dcterms:subject xsi:type="oerdc:Subjects">%s</dcterms:subject>' % escape(subject)
+                for subject in metadata.get('subjects', [])]
+    keywords = ['    <dcterms:subject>%s</dcterms:subject>' % escape(keyword)
+                for keyword in metadata.get('keywords', [])]
+    license = ''
+    if metadata.get('license'):
+        license = '    <dcterms:license xsi:type="dcterms:URI">%s</dcterms:license>' % escape(metadata['license'])
+    return TEMPLATE % {'title': escape(metadata.get('title') or title),
+                       'abstract': escape(metadata.get('abstract', '')),
+                       'language': escape(metadata.get('language', 'en')),
+                       'updated': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                       'roles': '\n'.join(role for role in roles if role),
+                       'subjects': '\n'.join(subjects),
+                       'keywords': '\n'.join(keywords),
+                       'license': license}
+
+
+def write_receipt(zipfilename, receiptfilename, title, creators, maintainers, rightholders):
+    """
+    Writes the atom entry of the module in the export zip to receiptfilename.
+    At the top level with plain arguments, so that it can run in a worker
+    process (see offload.py).
+    """
+    with open(receiptfilename, 'w') as receipt_file:
+        receipt_file.write(receipt(module_metadata(zipfilename), title, creators, maintainers, rightholders))
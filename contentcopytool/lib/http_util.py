@@ -1,26 +1,103 @@
-import urllib2
-import urllib
-import httplib
 from base64 import b64encode
+from functools import wraps
 from tempfile import mkstemp
-from os import close
+from os import close, path
 
-import requests
 import signal
 import subprocess
+import threading
+import time
 
 from util import CCTError
 
+import bandwidth
 import makemultipart as multi
+import memory
+import offload
+import tracing
 
 """
 This file contains some utility functions for the content-copy-tool that relate
 to http requests.
+
+The HTTP stacks (requests, urllib, urllib2, httplib) are imported inside the
+functions that use them, so that invocations that never touch the network
+(--help, --version, --dry-run) do not pay for loading them.
 """
 
 timeout = 300
+cassette = None  # a cassette.Cassette when requests are recorded or replayed
+listeners = []  # objects with request_started(kind, url) and
+                # request_finished(kind, url, status, bytes_down, bytes_up, elapsed) methods
+session = None  # the requests session of the HEAD requests, which keeps their connections for reuse
+session_lock = threading.Lock()
+POOL_SIZE = 16  # connections kept per host
+
+
+def start_alarm(handle_timeout):
+    """
+    Calls handle_timeout if the request is still running after [timeout]
+    seconds. Signals can only be used in the main thread, requests made by
+    worker threads go without the alert.
+    """
+    if isinstance(threading.current_thread(), threading._MainThread):
+        signal.signal(signal.SIGALRM, handle_timeout)
+        signal.alarm(timeout)
+
+
+def stop_alarm():
+    if isinstance(threading.current_thread(), threading._MainThread):
+        signal.alarm(0)
+
+
+def response_measures(response):
+    """ Returns the status, bytes received and bytes sent of a requests response. """
+    length = response.headers.get('Content-Length')
+    if length:
+        bytes_down = int(length)
+    elif getattr(response, '_content_consumed', True):
+        bytes_down = len(response.content or '')
+    else:
+        bytes_down = 0  # streamed and not read (yet)
+    body = response.request.body
+    return response.status_code, bytes_down, len(body) if isinstance(body, basestring) else 0
+
+
+def download_measures(filename):
+    return 200, path.getsize(filename) if path.exists(filename) else 0, 0
+
 
-def http_post_request(url, headers={}, auth=(), data={}):
+def upload_measures(result):
+    response, mpart, url = result
+    return response.status, 0, path.getsize(mpart)
+
+
+def observed(kind, url_argument, measures):
+    """
+    Decorates a request function so that the listeners are told when each
+    request starts and finishes, with its status and the bytes it moved.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            url = args[url_argument] if len(args) > url_argument else kwargs.get('url')
+            for listener in listeners:
+                listener.request_started(kind, url)
+            status, bytes_down, bytes_up = None, 0, 0
+            start = time.time()
+            try:
+                result = function(*args, **kwargs)
+                status, bytes_down, bytes_up = measures(result)
+                return result
+            finally:
+                for listener in listeners:
+                    listener.request_finished(kind, url, status, bytes_down, bytes_up, time.time() - start)
+        return wrapper
+    return decorator
+
+
+@observed('POST', 0, response_measures)
+def http_post_request(url, headers={}, auth=(), data={}, stream=False):
     """
     Sends a POST request to the specified url with the specified headers, data,
     and authentication tuple. Because we want to the post request to be successful
@@ -28,8 +105,12 @@ def http_post_request(url, headers={}, auth=(), data={}):
     would (i.e. POST is not converted to GET). Because we expect successful POSTs
     to redirect to the result of the request, temporary redirects are all treated
     as a 303 would (i.e. POST can be converted to GET) and then the following GET
-    request redirects are followed.
+    request redirects are followed. With stream=True the body of the final
+    response is not read until it is accessed.
     """
+    if cassette is not None and cassette.replaying:
+        return cassette.replay_response('POST', url)
+    import requests
 
     MAX_REDIRECTS = 4
     redirects = 0
@@ -41,14 +122,15 @@ def http_post_request(url, headers={}, auth=(), data={}):
         subprocess.call([bashCommand], shell=True)
 
     def follow_with_post(response):
-        return requests.post(response.headers['Location'], headers=headers, auth=auth, data=data, allow_redirects=False)
+        return requests.post(response.headers['Location'], headers=headers, auth=auth, data=data, allow_redirects=False,
+                             stream=stream)
 
     def follow_with_get(response):
-        return requests.Session().send(response.next, allow_redirects=False)
+        return requests.Session().send(response.next, allow_redirects=False, stream=stream)
 
-    signal.signal(signal.SIGALRM, handle_timeout)
-    signal.alarm(timeout)
-    response = requests.post(url, headers=headers, auth=auth, data=data, allow_redirects=False)
+    start_alarm(handle_timeout)
+    start = time.time()
+    response = requests.post(url, headers=headers, auth=auth, data=data, allow_redirects=False, stream=stream)
     while response.is_redirect and redirects < MAX_REDIRECTS:
         redirects += 1
         response = {
@@ -57,24 +139,65 @@ def http_post_request(url, headers={}, auth=(), data={}):
         }[response.is_permanent_redirect and response.request.method == 'POST'](response)
     if response.is_redirect:
         raise CCTError("POST redirection failed after maximum number of requests")
-    signal.alarm(0)
+    stop_alarm()
+    if cassette is not None:
+        cassette.record_response('POST', url, response, time.time() - start)
     return response
 
-def http_get_request(url, headers={}, auth=(), data={}):
+@observed('GET', 0, response_measures)
+def http_get_request(url, headers={}, auth=(), data={}, stream=False):
     """
     Sends a GET request to the specified url with the specified headers, data,
-    and authentication tuple.
+    and authentication tuple. With stream=True the body of the response is not
+    read until it is accessed.
     """
+    if cassette is not None and cassette.replaying:
+        return cassette.replay_response('GET', url)
+    import requests
+
     def handle_timeout(signal, frame):
         app = '"Terminal"'
         msg = '"Request: %s is taking an exceptionally long time, you might want to skip this task (Ctrl+z)"' % url
         bashCommand = "echo; osascript -e 'tell application "+app+"' -e 'activate' -e 'display alert "+msg+"' -e 'end tell'"
         subprocess.call([bashCommand], shell=True)
 
-    signal.signal(signal.SIGALRM, handle_timeout)
-    signal.alarm(timeout)
-    response = requests.get(url, headers=headers, auth=auth, data=data)
-    signal.alarm(0)
+    start_alarm(handle_timeout)
+    start = time.time()
+    response = requests.get(url, headers=headers, auth=auth, data=data, stream=stream)
+    stop_alarm()
+    if cassette is not None:
+        cassette.record_response('GET', url, response, time.time() - start)
+    return response
+
+def head_measures(response):
+    return response.status_code, 0, 0
+
+
+def pooled_session():
+    """ Returns the requests session shared by the HEAD requests of all threads. """
+    global session
+    with session_lock:
+        if session is None:
+            import requests
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        return session
+
+
+@observed('HEAD', 0, head_measures)
+def http_head_request(url, auth=()):
+    """
+    Sends a HEAD request to the specified url, redirects are followed. Used to
+    learn the size of a download (Content-Length) without downloading it.
+    """
+    if cassette is not None and cassette.replaying:
+        return cassette.replay_response('HEAD', url)
+    start = time.time()
+    response = pooled_session().head(url, auth=auth, allow_redirects=True, timeout=timeout)
+    if cassette is not None:
+        cassette.record_response('HEAD', url, response, time.time() - start)
     return response
 
 def http_request(url, headers={}, data={}):
@@ -83,6 +206,8 @@ def http_request(url, headers={}, data={}):
     data. If no data is provided, the request will be a GET, if data is provided
     the request will be a POST.
     """
+    import urllib
+    import urllib2
     request = urllib2.Request(url)
     if headers:
         for key, value in headers.iteritems():
@@ -95,45 +220,60 @@ def http_request(url, headers={}, data={}):
     except urllib2.HTTPError, e:
         print e.message
 
-def http_download_file(url, filename, extension):
-    """ Downloads the file at [url] and saves it as [filename.extension]. """
+@observed('DOWNLOAD', 0, download_measures)
+def http_download_file(url, filename, extension, auth=None):
+    """
+    Downloads the file at [url] and saves it as [filename.extension], the
+    body is streamed to the file. The authentication tuple is optional.
+    """
+    if cassette is not None and cassette.replaying:
+        cassette.replay_download(url, filename + extension)
+        return filename + extension
+    import requests
+
     def handle_timeout(signal, frame):
         app = '"Terminal"'
         msg = '"Download: %s is taking an exceptionally long time, you might want to skip this task (Ctrl+z)"' % url
         bashCommand = "echo; osascript -e 'tell application "+app+"' -e 'activate' -e 'display alert "+msg+"' -e 'end tell'"
         subprocess.call([bashCommand], shell=True)
 
-    signal.signal(signal.SIGALRM, handle_timeout)
-    signal.alarm(timeout)
+    start_alarm(handle_timeout)
+    start = time.time()
     try:
-        urllib.urlretrieve(url, filename + extension)
+        response = requests.get(url, auth=auth, stream=True)
+        with open(filename + extension, 'wb') as downloaded:
+            for chunk in response.iter_content(64 * 1024):
+                bandwidth.take(url, 'download', len(chunk))
+                downloaded.write(chunk)
     except Exception as e:
         print(e)
-    signal.alarm(0)
+    stop_alarm()
+    if cassette is not None:
+        cassette.record_download(url, filename + extension, time.time() - start)
     return filename + extension
 
 def extract_boundary(filename):
     """ Extracts the boundary line of a multipart file at filename. """
     boundary_start = 'boundary=\"'
     boundary_end = '\"'
-    with open(filename) as file:
-        text = file.read()
+    with open(filename, 'rb') as file:
+        text = file.read(4096)  # the boundary is declared in the top level headers
         start = text.find(boundary_start) + len(boundary_start)
         end = text.find(boundary_end, start)
         return text[start:end]
 
-def http_upload_file(xmlfile, zipfile, url, credentials, mpartfilename='tmp'):
+@observed('UPLOAD', 0, upload_measures)
+def http_send_deposit(url, filename, headers, credentials):
     """
-    Uploads a multipart file made up of the given xml and zip files to the
-    given url with the given credentials. The temporary multipartfile can be
-    named with the mpartfilename parameter.
+    POSTs the file to the SWORD endpoint at url with the headers and the
+    credentials. Returns the httplib response, the file name and the url.
     """
-    fh, abs_path = mkstemp('.mpart', mpartfilename)
-    multi.makemultipart(open(xmlfile), open(zipfile), open(abs_path, 'w'))
-    boundary_code = extract_boundary(abs_path)
-    userAndPass = b64encode(credentials).decode("ascii")
-    headers = {"Content-Type": "multipart/related;boundary=%s;type=application/atom + xml" % boundary_code,
-               "In-Progress": "true", "Accept-Encoding": "zip", "Authorization": 'Basic %s' % userAndPass}
+    import httplib
+    import urllib2
+
+    if cassette is not None and cassette.replaying:
+        return cassette.replay_upload(url), filename, url
+    headers = dict(headers, Authorization='Basic %s' % b64encode(credentials).decode("ascii"))
     req = urllib2.Request(url)
 
     def handle_timeout(signal, frame):
@@ -142,17 +282,66 @@ def http_upload_file(xmlfile, zipfile, url, credentials, mpartfilename='tmp'):
         bashCommand = "echo; osascript -e 'tell application "+app+"' -e 'activate' -e 'display alert "+msg+"' -e 'end tell'"
         subprocess.call([bashCommand], shell=True)
 
-    signal.signal(signal.SIGALRM, handle_timeout)
-    signal.alarm(timeout)
+    start_alarm(handle_timeout)
+    start = time.time()
     if url.startswith('https://'):
         connection = httplib.HTTPSConnection(req.get_host())
     else:
         connection = httplib.HTTPConnection(req.get_host())
-    connection.request('POST', req.get_selector(), open(abs_path), headers)
-    response = connection.getresponse()
-    signal.alarm(0)
+    with open(filename, 'rb') as body:
+        connection.request('POST', req.get_selector(), bandwidth.throttled(body, url), headers)
+        response = connection.getresponse()
+    stop_alarm()
+    if cassette is not None:
+        cassette.record_upload(url, response, time.time() - start)
+    return response, filename, url
+
+
+def http_send_deposit_retrying(url, filename, headers, credentials, retries=0):
+    """
+    http_send_deposit, sent again up to [retries] times (with a growing pause)
+    when the server answers with a 5xx status or the connection fails.
+    """
+    import httplib
+    import socket
+
+    attempt = 0
+    while True:
+        try:
+            result = http_send_deposit(url, filename, headers, credentials)
+            if result[0].status < 500 or attempt >= retries:
+                return result
+            result[0].close()  # the connection of the failed deposit is not kept while waiting
+        except (socket.error, httplib.HTTPException):
+            if attempt >= retries:
+                raise
+        attempt += 1
+        for listener in listeners:
+            if hasattr(listener, 'request_retried'):
+                listener.request_retried('UPLOAD', url)
+        time.sleep(min(2 ** attempt, 30))
+
+
+def http_upload_file(xmlfile, zipfile, url, credentials, mpartfilename='tmp', encoding='base64', retries=0):
+    """
+    Uploads a multipart file made up of the given xml and zip files to the
+    given url with the given credentials. The temporary multipartfile can be
+    named with the mpartfilename parameter. The zip file is sent with the
+    given Content-Transfer-Encoding, 'binary' or 'base64'. With retries, the
+    deposit is sent again after a server error.
+    """
+    fh, abs_path = mkstemp('.mpart', mpartfilename)
+    build = multi.makemultipart_files
+    if not memory.fits(path.getsize(zipfile), encoding):  # the package does not fit in the memory budget
+        build = multi.makemultipart_streaming
+    with tracing.span('multipart build', encoding=encoding, streaming=build is not multi.makemultipart_files):
+        offload.call(build, xmlfile, zipfile, abs_path, encoding)
     close(fh)
-    return response, abs_path, url
+    boundary_code = extract_boundary(abs_path)
+    headers = {"Content-Type": "multipart/related;boundary=%s;type=application/atom + xml" % boundary_code,
+               "In-Progress": "true", "Accept-Encoding": "zip"}
+    return http_send_deposit_retrying(url, abs_path, headers, credentials, retries)
+
 
 def verify(response, logger):
     """ Returns True if the response code is < 400, False otherwise. """
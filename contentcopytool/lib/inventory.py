@@ -0,0 +1,85 @@
+"""
+This file contains the inventory of the content-copy-tool: a local sqlite
+index of the workgroups and modules the tool created on the destination
+servers, kept when the inventory setting is given.
+
+A run of the same book that is repeated (for example after the output file of
+an earlier attempt was lost) finds the placeholders it created already instead
+of creating them again. Only what the tool created for the same book is
+reused: modules are keyed by server, book, workspace, chapter and title, and
+the modules that exist in a workspace otherwise are never claimed, since
+modules of different books often share their titles. A module is handed out
+once per run, so rows of the bookmap with the same title in the same chapter
+get modules of their own.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS workgroups (
+    server TEXT NOT NULL,
+    book TEXT NOT NULL,
+    title TEXT NOT NULL,
+    id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (server, book, title)
+);
+CREATE TABLE IF NOT EXISTS modules (
+    server TEXT NOT NULL,
+    module_id TEXT NOT NULL,
+    book TEXT NOT NULL,
+    workspace_url TEXT NOT NULL,
+    chapter TEXT NOT NULL,
+    title TEXT NOT NULL,
+    PRIMARY KEY (server, module_id)
+);
+CREATE INDEX IF NOT EXISTS modules_by_title ON modules (server, book, workspace_url, chapter, title);
+"""
+
+
+def normalize(url):
+    return url.rstrip('/')
+
+
+class Inventory:
+    """ The index of the workgroups and modules created for [book] on the destination servers. """
+    def __init__(self, filename, book):
+        import sqlite3
+        self.filename = filename
+        self.book = book
+        self.connection = sqlite3.connect(filename)
+        self.connection.text_factory = str
+        self.connection.executescript(SCHEMA)
+        self.claimed = set()  # (server, module id) of the modules handed out in this run
+
+    def close(self):
+        self.connection.close()
+
+    def find_workgroup(self, server, title):
+        """ Returns the (id, url) of the workgroup with the title created for the book, or None. """
+        return self.connection.execute("SELECT id, url FROM workgroups WHERE server = ? AND book = ? AND title = ?",
+                                       (normalize(server), self.book, title)).fetchone()
+
+    def add_workgroup(self, server, title, workgroup_id, url):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO workgroups VALUES (?, ?, ?, ?, ?)",
+                                    (normalize(server), self.book, title, workgroup_id, normalize(url)))
+
+    def find_module(self, server, workspace_url, chapter, title):
+        """
+        Returns the id of a module with the title created in the chapter of the
+        book that was not handed out in this run yet, or None.
+        """
+        rows = self.connection.execute("SELECT module_id FROM modules WHERE server = ? AND book = ? "
+                                       "AND workspace_url = ? AND chapter = ? AND title = ? ORDER BY rowid",
+                                       (normalize(server), self.book, normalize(workspace_url), chapter, title))
+        for (module_id,) in rows:
+            if (normalize(server), module_id) not in self.claimed:
+                self.claimed.add((normalize(server), module_id))
+                return module_id
+        return None
+
+    def add_module(self, server, workspace_url, chapter, title, module_id):
+        self.claimed.add((normalize(server), module_id))
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO modules VALUES (?, ?, ?, ?, ?, ?)",
+                                    (normalize(server), module_id, self.book, normalize(workspace_url), chapter,
+                                     title))
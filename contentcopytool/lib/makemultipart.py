@@ -1,11 +1,25 @@
 #!/usr/bin/python
 import os
-import argparse
-from email.MIMEMultipart import MIMEMultipart
-from email.MIMEBase import MIMEBase
-from email import Encoders
 
-def makemultipart(atomfile, package, outfile):
+
+ENCODINGS = ('binary', 'base64')
+
+
+def makemultipart(atomfile, package, outfile, encoding='base64'):
+    """
+    Writes a multipart/related SWORD deposit made of the atom entry and the
+    package to outfile. With encoding='binary' the package is written as is
+    (Content-Transfer-Encoding: binary), with 'base64' it is base64 encoded.
+    """
+    # the email package is only loaded when a multipart file is actually built
+    from email.MIMEMultipart import MIMEMultipart
+    from email.MIMEBase import MIMEBase
+    from email.generator import Generator
+    from email import Encoders
+
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown payload encoding: %s" % encoding)
+
     atompart = MIMEBase('application', 'atom+xml')
     atompart.add_header('Content-Disposition', 'attachment; name=atom')
     atompart.set_payload(atomfile.read())
@@ -15,25 +29,75 @@ def makemultipart(atomfile, package, outfile):
         'attachment; name=payload; filename=%s' % os.path.basename(
             package.name))
     payloadpart.set_payload(package.read())
-    Encoders.encode_base64(payloadpart)
+    if encoding == 'binary':
+        payloadpart.add_header('Content-Transfer-Encoding', 'binary')
+    else:
+        Encoders.encode_base64(payloadpart)
 
     message = MIMEMultipart('related')
     message.attach(atompart)
     message.attach(payloadpart)
 
-    # print(message.as_string(unixfrom=False))
-    outfile.write(message.as_string(unixfrom=False))
+    # mangle_from_ would rewrite lines starting with "From " inside a binary payload
+    Generator(outfile, mangle_from_=False).flatten(message, unixfrom=False)
     outfile.close()
 
 
+def makemultipart_files(atomfilename, packagefilename, outfilename, encoding='base64'):
+    """ makemultipart with file names, so that it can run in a worker process (see offload.py). """
+    with open(atomfilename) as atomfile:
+        with open(packagefilename, 'rb') as package:
+            makemultipart(atomfile, package, open(outfilename, 'wb'), encoding)
+
+
+def makemultipart_streaming(atomfilename, packagefilename, outfilename, encoding='base64'):
+    """
+    Writes the same multipart deposit as makemultipart_files, copying the
+    package in chunks instead of holding it (and its base64 form) in memory.
+    Used when the memory budget would not fit the package (see memory.py).
+    """
+    import base64
+    import random
+    import sys
+
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown payload encoding: %s" % encoding)
+    boundary = '=' * 15 + '%019d' % random.randrange(sys.maxint) + '=='
+    with open(outfilename, 'wb') as outfile:
+        outfile.write('Content-Type: multipart/related;\n boundary="%s"\nMIME-Version: 1.0\n\n' % boundary)
+        outfile.write('--%s\nContent-Type: application/atom+xml\nMIME-Version: 1.0\n'
+                      'Content-Disposition: attachment; name=atom\n\n' % boundary)
+        with open(atomfilename) as atomfile:
+            outfile.write(atomfile.read())
+        outfile.write('\n--%s\nContent-Type: application/zip\nMIME-Version: 1.0\n'
+                      'Content-Disposition: attachment; name=payload; filename=%s\n'
+                      'Content-Transfer-Encoding: %s\n\n' % (boundary, os.path.basename(packagefilename), encoding))
+        chunk_size = 57 * 1024  # 57 bytes make one 76 character line of base64
+        last = ''
+        with open(packagefilename, 'rb') as package:
+            while True:
+                chunk = package.read(chunk_size)
+                if not chunk:
+                    break
+                last = chunk
+                outfile.write(base64.encodestring(chunk) if encoding == 'base64' else chunk)
+        if encoding == 'base64' and last and not last.endswith('\n'):
+            outfile.seek(-1, os.SEEK_END)  # like the email package, end the base64 with a newline only if the
+            outfile.truncate()             # package ends with one
+        outfile.write('\n--%s--\n' % boundary)
+
+
 def main():
+    import argparse
     parser = argparse.ArgumentParser(description='Create a multipart file from an atom entry and a package '
                                                  '(zip, word, odt)')
     parser.add_argument('atomfile', help='/path/to/atomfile', type=open)
-    parser.add_argument('package', help='/path/to/package', type=open)
-    parser.add_argument('outfile', help='name of output file', type=argparse.FileType('w + '))
+    parser.add_argument('package', help='/path/to/package', type=argparse.FileType('rb'))
+    parser.add_argument('outfile', help='name of output file', type=argparse.FileType('wb'))
+    parser.add_argument('--encoding', choices=ENCODINGS, default='base64',
+                        help='Content-Transfer-Encoding of the package part')
     args = parser.parse_args()
-    makemultipart(args.atomfile, args.package, args.outfile)
+    makemultipart(args.atomfile, args.package, args.outfile, args.encoding)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,167 @@
+import gc
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+"""
+This file contains the memory instrumentation of the content-copy-tool.
+
+With --memory, a monitor samples the resident set size (RSS) of the tool
+while it runs and records the peak of each phase and of each copied module.
+At the start and end of each phase the live objects are counted by type, and
+the types that grew the most are reported with the peaks. Python 2 cannot
+trace allocation sites; the garbage collector only sees container objects,
+so large strings (file contents) show in the RSS but not in the type counts.
+The peak of a module is the peak of the tool while the module was copied, it
+only tells the memory of that module with one copy worker. The work done in
+the offload worker processes (see offload.py) is not in the RSS of the tool.
+
+With the memory_budget_mb setting, the tool warns when a module leaves the
+tool above the budget, and builds the multipart deposit of a module in a
+streaming way when holding its package in memory would exceed the budget.
+"""
+
+monitor = None
+budget = None  # bytes
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss():
+    """ Returns the current resident set size of the tool in bytes. """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (IOError, IndexError, ValueError):
+        return peak_rss()  # no /proc (OS X), the peak is the best estimate
+
+
+def peak_rss():
+    """ Returns the peak resident set size of the tool in bytes. """
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # kilobytes on Linux
+
+
+def megabytes(size):
+    return size / (1024.0 * 1024)
+
+
+def type_counts():
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def phase(name):
+    """ Records the peak memory of the phase [name] (the body of the with statement). """
+    if monitor is None:
+        return nothing()
+    return monitor.phase(name)
+
+
+def module(name):
+    """ Records the peak memory while the module [name] is copied. """
+    if monitor is None:
+        return nothing()
+    return monitor.module(name)
+
+
+@contextmanager
+def nothing():
+    yield
+
+
+def fits(size, encoding):
+    """
+    Returns False if building the deposit of a package of [size] bytes in
+    memory could exceed the budget. The build usually runs in an offload
+    worker process, whose memory the RSS of the tool does not show, so only
+    the memory the build holds is compared with the budget.
+    """
+    if budget is None:
+        return True
+    held = size * (3 if encoding == 'base64' else 2)  # the package, its encoded form and the output buffer
+    return held <= budget
+
+
+def check(logger, name):
+    """ Warns if the tool uses more memory than the budget after [name]. """
+    if budget is not None:
+        used = rss()
+        if used > budget:
+            logger.warn("\033[91mMemory use %.1f MB is over the memory budget of %.1f MB after %s\033[0m" %
+                        (megabytes(used), megabytes(budget), name))
+
+
+class MemoryMonitor:
+    """ Samples the RSS every [interval] seconds and keeps the peaks of the open phases and modules. """
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.open = {}  # id of the record -> record of a phase or module that is running
+        self.phases = []
+        self.modules = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='memory-monitor')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        size = rss()
+        with self.lock:
+            for record in self.open.itervalues():
+                record['peak'] = max(record['peak'], size)
+
+    def stop(self):
+        self.running = False
+
+    @contextmanager
+    def measure(self, name, records):
+        size = rss()
+        record = {'name': name, 'start': size, 'peak': size}
+        with self.lock:
+            self.open[id(record)] = record
+        try:
+            yield record
+        finally:
+            self.sample()
+            with self.lock:
+                del self.open[id(record)]
+                record['end'] = rss()
+                records.append(record)
+
+    @contextmanager
+    def phase(self, name):
+        before = type_counts()
+        with self.measure(name, self.phases) as record:
+            yield
+        after = type_counts()
+        after.subtract(before)
+        record['growth'] = [(type_name, count) for type_name, count in after.most_common(5) if count > 0]
+
+    def module(self, name):
+        return self.measure(name, self.modules)
+
+    def report(self, logger, limit=10):
+        """ Logs the peaks of the phases, the modules with the highest peaks and the types that grew the most. """
+        logger.info("-------- Memory -----------------------------------------")
+        logger.info("Peak RSS of the run: \033[95m%.1f MB\033[0m" % megabytes(peak_rss()))
+        for record in self.phases:
+            logger.info("Phase %s: %.1f MB at the start, peak %.1f MB, %.1f MB at the end" %
+                        (record['name'], megabytes(record['start']), megabytes(record['peak']),
+                         megabytes(record['end'])))
+            if record.get('growth'):
+                logger.info("  objects that grew the most: %s" %
+                            ', '.join("%s +%d" % (type_name, count) for type_name, count in record['growth']))
+        if self.modules:
+            logger.info("Modules with the highest peak (peak / growth while copied):")
+            for record in sorted(self.modules, key=lambda record: record['peak'], reverse=True)[:limit]:
+                logger.info("  %8.1f MB %+8.1f MB  %s" % (megabytes(record['peak']),
+                                                         megabytes(record['peak'] - record['start']), record['name']))
@@ -0,0 +1,214 @@
+import os
+import re as regex
+import threading
+import time
+from urlparse import urlparse
+
+"""
+This file contains the metrics of the content-copy-tool.
+
+The metrics are kept in a registry of counters, gauges and histograms and are
+exported in the Prometheus text exposition format, either on a local HTTP
+endpoint (/metrics) or as a text file that is rewritten periodically (for the
+node_exporter textfile collector, for example).
+
+The registry is fed by the HTTP layer (it is one of http_util.listeners), by
+the progress reporter (module outcomes and queue depths) and by the list of
+failures.
+"""
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+ID_SEGMENT = regex.compile(r'^(m|col|wg)\d+$|^[\w.-]*\d{4}-\d\d-\d\d[\w.-]*$|^\d+(\.\d+)*$|^latest$')
+
+HELP = {
+    'cct_requests_total': 'HTTP requests made, by operation, kind and status.',
+    'cct_requests_in_flight': 'HTTP requests currently in flight.',
+    'cct_bytes_total': 'Bytes moved over HTTP, by direction and operation.',
+    'cct_request_duration_seconds': 'Duration of HTTP requests, by operation.',
+    'cct_transfer_bytes': 'Size of downloads and uploads, by kind.',
+    'cct_module_outcomes_total': 'Modules processed, by phase and outcome.',
+    'cct_failures_total': 'Failures reported at the end of the run, by operation.',
+    'cct_queue_depth': 'Modules remaining in the current phase.',
+    'cct_retries_total': 'Retried requests, by operation.',
+}
+
+
+def operation_name(url):
+    """ Returns a low cardinality name for the operation at url, e.g. 'module_export' or 'sword'. """
+    segments = [segment for segment in urlparse(url or '').path.split('/') if segment]
+    for segment in reversed(segments):
+        if not ID_SEGMENT.match(segment):
+            return segment
+    return '/'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels)
+
+
+class MetricsRegistry:
+    """ A thread safe registry of counters, gauges and histograms. """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.types = {}
+        self.values = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self.buckets = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.types.setdefault(name, 'counter')
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.types.setdefault(name, 'gauge')
+            self.values[key] = value
+
+    def observe(self, name, value, buckets=DURATION_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.types.setdefault(name, 'histogram')
+            self.buckets.setdefault(name, buckets)
+            histogram = self.histograms.setdefault(key, [[0] * len(self.buckets[name]), 0.0, 0])
+            for index, bound in enumerate(self.buckets[name]):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self):
+        """ Returns the metrics in the Prometheus text exposition format. """
+        lines = []
+        with self.lock:
+            for name in sorted(self.types):
+                if name in HELP:
+                    lines.append("# HELP %s %s" % (name, HELP[name]))
+                lines.append("# TYPE %s %s" % (name, self.types[name]))
+                if self.types[name] == 'histogram':
+                    for (metric, labels), (counts, total, count) in sorted(self.histograms.iteritems()):
+                        if metric != name:
+                            continue
+                        for bound, bucket_count in zip(self.buckets[name], counts):
+                            lines.append("%s_bucket%s %d" % (name, format_labels(labels + (('le', repr(float(bound))),)),
+                                                             bucket_count))
+                        lines.append("%s_bucket%s %d" % (name, format_labels(labels + (('le', '+Inf'),)), count))
+                        lines.append("%s_sum%s %r" % (name, format_labels(labels), total))
+                        lines.append("%s_count%s %d" % (name, format_labels(labels), count))
+                else:
+                    for (metric, labels), value in sorted(self.values.iteritems()):
+                        if metric == name:
+                            lines.append("%s%s %r" % (name, format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    # http_util listener interface
+    def request_started(self, kind, url):
+        with self.lock:
+            key = ('cct_requests_in_flight', ())
+            self.types.setdefault('cct_requests_in_flight', 'gauge')
+            self.values[key] = self.values.get(key, 0) + 1
+
+    def request_finished(self, kind, url, status, bytes_down, bytes_up, elapsed):
+        operation = operation_name(url)
+        with self.lock:
+            key = ('cct_requests_in_flight', ())
+            self.values[key] = max(0, self.values.get(key, 0) - 1)
+        self.inc('cct_requests_total', operation=operation, kind=kind, status=status or 'error')
+        self.observe('cct_request_duration_seconds', elapsed, operation=operation)
+        if bytes_down:
+            self.inc('cct_bytes_total', bytes_down, direction='down', operation=operation)
+        if bytes_up:
+            self.inc('cct_bytes_total', bytes_up, direction='up', operation=operation)
+        if kind in ('DOWNLOAD', 'UPLOAD'):
+            self.observe('cct_transfer_bytes', bytes_down + bytes_up, SIZE_BUCKETS, kind=kind)
+
+    def request_retried(self, kind, url):
+        self.inc('cct_retries_total', operation=operation_name(url), kind=kind)
+
+    # progress reporter interface
+    def module_done(self, phase, ok, remaining):
+        self.inc('cct_module_outcomes_total', phase=phase, outcome='success' if ok else 'failure')
+        self.set('cct_queue_depth', remaining, phase=phase)
+
+
+class TrackedFailures(list):
+    """ The list of failures of a run, counting each failure in the metrics registry. """
+    def __init__(self, registry):
+        list.__init__(self)
+        self.registry = registry
+
+    def append(self, failure):
+        list.append(self, failure)
+        self.registry.inc('cct_failures_total', operation=failure[1].strip(' :'))
+
+
+class MetricsExporter:
+    """ Serves the registry on http://[address]:[port]/metrics and/or rewrites it to a file. """
+    def __init__(self, registry, port=None, filename=None, interval=15, address='127.0.0.1'):
+        self.registry = registry
+        self.filename = filename
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.server = None
+        self.writer = None
+        if port is not None:
+            from BaseHTTPServer import HTTPServer
+            self.server = HTTPServer((address, port), self.handler())
+            thread = threading.Thread(target=self.server.serve_forever, name='metrics-http')
+            thread.daemon = True
+            thread.start()
+        if filename:
+            self.writer = threading.Thread(target=self.write_periodically, name='metrics-file')
+            self.writer.daemon = True
+            self.writer.start()
+
+    def handler(self):
+        from BaseHTTPServer import BaseHTTPRequestHandler
+        registry = self.registry
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        return MetricsHandler
+
+    def write(self):
+        """ Atomically replaces the metrics file with the current metrics. """
+        temp_file = "%s.%d.tmp" % (self.filename, os.getpid())
+        with open(temp_file, 'w') as out:
+            out.write(self.registry.render())
+        os.rename(temp_file, self.filename)
+
+    def write_periodically(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def url(self):
+        if self.server is None:
+            return None
+        return "http://%s:%d/metrics" % self.server.server_address
+
+    def stop(self):
+        self.stopped.set()
+        if self.writer is not None:
+            self.writer.join()
+        if self.filename:
+            self.write()
+        if self.server is not None:
+            self.server.shutdown()
@@ -0,0 +1,53 @@
+import signal
+
+"""
+This file contains the process pool of the content-copy-tool.
+
+The CPU bound steps of a copy (cleaning the module zip, building the
+multipart deposit, rewriting the roles in the deposit receipt) hold the GIL,
+so with several copy workers they run one at a time. When the pool is
+started, call() runs them in worker processes instead. Only file names and
+small arguments are sent to the workers, the files are read and written by
+the worker itself.
+
+Without a pool (the default for a sequential run), call() runs the function
+in the calling thread.
+"""
+
+pool = None
+
+
+def ignore_signals():
+    """ Leaves Ctrl+C and Ctrl+Z to the main process. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTSTP, signal.SIG_IGN)
+
+
+def start(workers):
+    """ Starts a pool of [workers] processes, if workers is more than 1. """
+    global pool
+    if workers > 1 and pool is None:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers, ignore_signals)
+
+
+def stop():
+    global pool
+    if pool is not None:
+        pool.close()
+        pool.join()
+        pool = None
+
+
+def call(function, *args):
+    """
+    Returns function(*args), computed in a worker process when the pool is
+    started. The function must be defined at the top level of a module and
+    the arguments must be picklable.
+    """
+    if pool is None:
+        return function(*args)
+    result = pool.apply_async(function, args)
+    while not result.ready():
+        result.wait(0.5)  # a timed wait lets the signal handlers of the main thread run
+    return result.get()
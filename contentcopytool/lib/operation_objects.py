@@ -1,9 +1,17 @@
 from shutil import rmtree
 from os import remove, path, walk, getpid
+from urlparse import urlparse
 import re as regex
 import traceback
-import zipfile
 import http_util as http
+import response_parsing as parsing
+import scheduling
+import deposit_receipt
+import memory
+import offload
+import tracing
+import validation
+import verification
 from role_updates import RoleUpdater
 from util import CCTError, SkipSignal, TerminateError
 from bookmap import Collection
@@ -16,16 +24,48 @@ This file contains the Copy and Content Creation related objects
 # Configuration Objects
 class CopyConfiguration:
     """ The configuration data that the copier requires. """
-    def __init__(self, source_server, destination_server, credentials):
+    def __init__(self, source_server, destination_server, credentials, upload_encoding='base64', copy_workers=1,
+                 size_cache=None, synthesize_receipts=False, name=None, upload_retries=0):
         self.source_server = source_server
         self.destination_server = destination_server
         self.credentials = credentials
+        self.upload_encoding = upload_encoding
+        self.copy_workers = copy_workers
+        self.size_cache = size_cache
+        self.synthesize_receipts = synthesize_receipts  # write the deposit receipts locally when roles are replaced
+        self.name = name  # the name of the destination in the destinations setting
+        self.upload_retries = upload_retries
+
+
+class DestinationFailures:
+    """ The failures of the steps on one destination, added to the failures of the run with its name. """
+    def __init__(self, failures, name):
+        self.failures = failures
+        self.name = name
+
+    def append(self, failure):
+        self.failures.append(("%s: %s" % (self.name, failure[0]),) + tuple(failure[1:]))
+
+
+class Destination:
+    """
+    A destination of the run: its copy configuration, the bookmap read with
+    its destination columns and its content creator.
+    """
+    def __init__(self, copy_config, bookmap, content_creator, failures):
+        self.copy_config = copy_config
+        self.bookmap = bookmap
+        self.content_creator = content_creator
+        self.failures = DestinationFailures(failures, copy_config.name) if copy_config.name else failures
 
 
 class RunOptions:
     """ The input options that describe what the tool will do. """
     def __init__(self, modules, workgroups, copy, roles, accept_roles, collections, units,
-                 publish, publish_collection, chapters, exclude, dryrun):
+                 publish, publish_collection, chapters, exclude, dryrun, profile=None, record=None, replay=None,
+                 replay_speed=1.0, metrics_port=None, metrics_file=None, verify=None,
+                 trace=None, export_bundle=None, import_bundle=None, memory=False,
+                 source_collection=None):
         self.modules = modules
         self.workgroups = workgroups
         if self.workgroups:
@@ -40,50 +80,115 @@ class RunOptions:
         self.chapters = chapters
         self.exclude = exclude
         self.dryrun = dryrun
+        self.profile = profile
+        self.record = record
+        self.replay = replay
+        self.replay_speed = replay_speed
+        self.metrics_port = metrics_port
+        self.metrics_file = metrics_file
+        self.verify = verify
+        self.trace = trace
+        self.export_bundle = export_bundle
+        self.import_bundle = import_bundle
+        self.memory = memory
+        self.source_collection = source_collection
+
+
+# Zip file operations, at the top level so that they can run in the process pool (see offload.py)
+def extract_zip(zipfilepath):
+    """ Extracts the data from the given zip file. """
+    import zipfile
+    with zipfile.ZipFile(zipfilepath, "r") as zipf:
+        temp_item = zipf.namelist()[0]
+        new_dir = temp_item[:temp_item.find('/')]
+        zipf.extractall()
+    return new_dir
+
+
+def remove_file_from_dir(directory, filename):
+    """ Removes the given file from the given directory. """
+    remove("%s/%s" % (directory, filename))
+
+
+def zipdir(file_path, zipfilename):
+    """ Zips the given directory into a zip file with the given name. """
+    import zipfile
+    zipf = zipfile.ZipFile(zipfilename, 'w')
+    for root, dirs, files in walk(file_path):
+        for file_in_dir in files:
+            zipf.write(path.join(root, file_in_dir))
+    zipf.close()
+    rmtree(file_path)
+
+
+def clean_zip(zipfilename, path_to_tool):
+    """ Removes the index.cnxml.html file if it is in the given zipfile. """
+    import zipfile
+    zipfileobject = zipfile.ZipFile(zipfilename, 'r')
+    for filename in zipfileobject.namelist():
+        if regex.search(r'.*/index.cnxml.html', filename):
+            dir = extract_zip(zipfilename)
+            remove(zipfilename)
+            directory = "%s/%s" % (path_to_tool, dir)
+            remove_file_from_dir(directory, 'index.cnxml.html')
+            zipdir(directory, zipfilename)
+            break
+
+
+class LiveSource:
+    """ The source of the module exports and receipts on the source server. """
+    def __init__(self, source_server):
+        self.source_server = source_server
+
+    def has(self, source_id):
+        return True
+
+    def download_export(self, source_id, directory=''):
+        return http.http_download_file("%s/content/%s/latest/module_export?format=zip&nonce=%s"
+                                       % (self.source_server, source_id, getpid()), path.join(directory, source_id),
+                                       '.zip')
+
+    def download_receipt(self, source_id, directory=''):
+        return http.http_download_file("%s/content/%s/latest/rhaptos-deposit-receipt?nonce=%s"
+                                       % (self.source_server, source_id, getpid()), path.join(directory, source_id),
+                                       '.xml')
+
+    def export_sizes(self, modules, cache, workers):
+        return scheduling.probe_sizes(modules, self.source_server, cache, workers)
 
 
 # Operation Objects
 class Copier:
     """ The object that does the copying from one server to another. """
-    def __init__(self, config, copy_map, path_to_tool):
+    def __init__(self, config, copy_map, path_to_tool, source=None, mirrors=()):
         self.config = config
         self.copy_map = copy_map
         self.path_to_tool = path_to_tool
+        # a bundle.BundleSource, prefetch.PrefetchSource or collection_export.CollectionExportSource can stand in
+        self.source = source or LiveSource(config.source_server)
+        self.mirrors = mirrors  # the other Destinations, each module is uploaded to the same row of their bookmap
+        self.module_index = dict((id(module), index) for index, module in enumerate(copy_map.modules))
+        self.source_digests = {}  # source id -> zip entry digests of the uploaded zip, for --verify
+        self.size_cache = scheduling.ExportSizeCache(config.size_cache)
+        self.fanout = None  # the threads that upload a module to every destination, during copy_content
 
     def extract_zip(self, zipfilepath):
         """ Extracts the data from the given zip file. """
-        with zipfile.ZipFile(zipfilepath, "r") as zipf:
-            temp_item = zipf.namelist()[0]
-            new_dir = temp_item[:temp_item.find('/')]
-            zipf.extractall()
-        return new_dir
+        return extract_zip(zipfilepath)
 
     def remove_file_from_dir(self, directory, filename):
         """ Removes the given file from the given directory. """
-        remove("%s/%s" % (directory, filename))
+        remove_file_from_dir(directory, filename)
 
     def zipdir(self, file_path, zipfilename):
         """ Zips the given directory into a zip file with the given name. """
-        zipf = zipfile.ZipFile(zipfilename, 'w')
-        for root, dirs, files in walk(file_path):
-            for file_in_dir in files:
-                zipf.write(path.join(root, file_in_dir))
-        zipf.close()
-        rmtree(file_path)
+        zipdir(file_path, zipfilename)
 
     def clean_zip(self, zipfilename):
-        """ Removes the index.cnxml.html file if it is in the given zipfile. """
-        zipfileobject = zipfile.ZipFile(zipfilename, 'r')
-        for filename in zipfileobject.namelist():
-            if regex.search(r'.*/index.cnxml.html', filename):
-                dir = self.extract_zip(zipfilename)
-                remove(zipfilename)
-                zipdir = "%s/%s" % (self.path_to_tool, dir)
-                self.remove_file_from_dir(zipdir, 'index.cnxml.html')
-                self.zipdir(zipdir, zipfilename)
-                break
-
-    def copy_content(self, role_config, run_options, logger, failures):
+        """ Removes the index.cnxml.html file if it is in the given zipfile (in the process pool, if started). """
+        offload.call(clean_zip, zipfilename, self.path_to_tool)
+
+    def copy_content(self, role_config, run_options, logger, failures, progress=None):
         """
         Copies content from source server to server specified by each entry in the
         content copy map.
@@ -92,117 +197,268 @@ class Copier:
           role_config - the configuration with the role update information
           run_options - the input running options that tell the tool what to do on this run
           logger      - a reference to the tool's logger
+          failures    - the list of failures to track failed copies
+          progress    - (optional) the progress reporter
 
         Returns:
           Nothing. It will, however, leave temporary & downloaded files for content
           that did not succeed in transfer.
         """
-        for module in self.copy_map.modules:
-            if module.valid and module.chapter_number in run_options.chapters:
-                if not module.destination_workspace_url or module.destination_workspace_url == "":
-                    logger.error("Module %s destination workspace url is invalid: %s" %
-                                 (module.title, module.destination_workspace_url))
-                    module.valid = False
-                    failures.append((module.full_title(), "copying module"))
-                    continue
-                if not module.destination_id or module.destination_id == "":
-                    logger.error("Module %s destination id is invalid: %s" %
-                                 (module.title, module.destination_id))
-                    module.valid = False
-                    failures.append((module.full_title(), "copying module"))
-                    continue
-                http_server = regex.match(r'https?://', self.config.destination_server)
-                http_workgroup = regex.match(r'https?://', module.destination_workspace_url)
-                if not http_server or not http_workgroup:
-                    logger.error("Either the destination server: %s or "
-                                 "the module's destination workgroup url: %s is bad." %
-                                 (self.config.destination_server, module.destination_workspace_url))
-                    logger.error("Failure copying module %s" % module.source_id)
-                    module.valid = False
-                    failures.append((module.full_title(), "copying module"))
-                    continue
+        modules = [module for module in self.copy_map.modules if module.chapter_number in run_options.chapters and
+                   any(target.valid for config, target, target_failures in self.targets(module))]
+        if progress:
+            progress.start_phase('copy', len(modules))
+        if self.mirrors:  # one pool for the uploads of the whole run, each worker fans out to every destination
+            from multiprocessing.pool import ThreadPool
+            self.fanout = ThreadPool((len(self.mirrors) + 1) * max(1, self.config.copy_workers))
+        try:
+            if self.config.copy_workers > 1 and len(modules) > 1:
+                self.copy_concurrently(modules, role_config, run_options, logger, failures, progress)
+            else:
+                for module in modules:
+                    with tracing.span('copy module', module=module.source_id, title=module.title), \
+                            memory.module("%s - %s" % (module.source_id, module.title)):
+                        copied = self.copy_module(module, role_config, run_options, logger, failures)
+                    memory.check(logger, "module %s" % module.source_id)
+                    if progress:
+                        progress.module_done(copied)
+        finally:
+            if self.fanout is not None:
+                self.fanout.terminate()
+                self.fanout = None
+            self.size_cache.save()
+            if progress:
+                progress.finish_phase()
+
+    def copy_concurrently(self, modules, role_config, run_options, logger, failures, progress=None):
+        """
+        Copies the modules with [copy_workers] workers, starting with the
+        largest source exports. The log records and failures of each module
+        are written out in bookmap order once the module is done. Modules
+        with the same source id write the same files, they are copied one
+        after the other by the same worker.
+        """
+        from multiprocessing.pool import ThreadPool
+        sizes = self.source.export_sizes(modules, self.size_cache, self.config.copy_workers)
+        order = scheduling.largest_first(modules, sizes)
+        logger.debug("Copying with %d workers, %d of %d export sizes known, largest first: %s" %
+                     (self.config.copy_workers, len(sizes), len(modules),
+                      ', '.join(module.source_id for module in order)))
+
+        def copy(group):
+            copied_modules = {}
+            for module in group:
+                module_logger = scheduling.BufferedLogger(logger)
+                module_failures = []
+                with tracing.span('copy module', module=module.source_id, title=module.title), \
+                        memory.module("%s - %s" % (module.source_id, module.title)):
+                    copied = self.copy_module(module, role_config, run_options, module_logger, module_failures)
+                memory.check(module_logger, "module %s" % module.source_id)
+                if progress:
+                    progress.module_done(copied)
+                copied_modules[id(module)] = module_logger, module_failures
+            return copied_modules
+
+        groups = {}  # source id -> its modules, in bookmap order
+        for module in modules:
+            groups.setdefault(module.source_id, []).append(module)
+        pool = ThreadPool(self.config.copy_workers)
+        results = {}
+        for module in order:
+            if id(module) not in results:
+                group = groups[module.source_id]
+                result = pool.apply_async(copy, (group,))
+                for member in group:
+                    results[id(member)] = result
+        pool.close()
+        try:
+            for module in modules:
+                result = results[id(module)]
+                while not result.ready():
+                    try:
+                        result.wait(0.5)  # a timed wait lets the signal handlers run
+                    except SkipSignal:
+                        logger.warn("Modules cannot be skipped while copying with several workers.")
+                module_logger, module_failures = result.get()[id(module)]
+                module_logger.flush()
+                for failure in module_failures:
+                    failures.append(failure)
+        except TerminateError:
+            pool.terminate()
+            raise
+        pool.join()
+
+    def targets(self, module):
+        """
+        Returns the (copy configuration, module, failures) of the module on
+        each destination, this copier's first. The failures are None for this
+        copier's destination, whose failures are passed to copy_module.
+        """
+        targets = [(self.config, module, None)]
+        if self.mirrors:
+            index = self.module_index[id(module)]
+            targets.extend((mirror.copy_config, mirror.bookmap.bookmap.modules[index], mirror.failures)
+                           for mirror in self.mirrors)
+        return targets
+
+    def can_copy_to(self, config, module, logger, failures):
+        """ Checks the destination of the module, a module that cannot be copied there is marked invalid. """
+        if not module.destination_workspace_url or module.destination_workspace_url == "":
+            logger.error("Module %s destination workspace url is invalid: %s" %
+                         (module.title, module.destination_workspace_url))
+            module.valid = False
+            failures.append((module.full_title(), "copying module"))
+            return False
+        if not module.destination_id or module.destination_id == "":
+            logger.error("Module %s destination id is invalid: %s" %
+                         (module.title, module.destination_id))
+            module.valid = False
+            failures.append((module.full_title(), "copying module"))
+            return False
+        problem = validation.workspace_problem(module, validation.normalized_host(config.destination_server))
+        if problem:
+            logger.error("Module %s cannot be copied: %s" % (module.title, problem))
+            logger.error("Failure copying module %s" % module.source_id)
+            module.valid = False
+            failures.append((module.full_title(), "copying module"))
+            return False
+        return True
+
+    def upload(self, target, source_id):
+        """ Uploads the prepared files to one destination, returns (response, multipart file, url, error). """
+        config, module, failures = target
+        try:
+            with tracing.span('upload', module=source_id, destination=module.destination_id):
+                res, mpart, url = http.http_upload_file("%s.xml" % source_id, "%s.zip" % source_id,
+                                                        "%s/%s/sword" % (module.destination_workspace_url,
+                                                                         module.destination_id),
+                                                        config.credentials, encoding=config.upload_encoding,
+                                                        retries=config.upload_retries)
+            return res, mpart, url, None
+        except TerminateError:
+            raise TerminateError("Terminate Signaled")
+        except Exception as e:
+            return None, None, None, (e, traceback.format_exc())
+
+    def copy_module(self, module, role_config, run_options, logger, failures):
+        """
+        Copies one module from the source server to its destination workspace,
+        and to the same module on the other destinations (see mirrors). The
+        module is downloaded and prepared once, then uploaded to every
+        destination at the same time.
+
+        Returns:
+          True if the module was copied to a destination, False if it failed
+          everywhere (the failures are added to the failures of each
+          destination and the modules are marked invalid).
+        """
+        targets = [(config, target, target_failures or failures)
+                   for config, target, target_failures in self.targets(module)
+                   if target.valid and self.can_copy_to(config, target, logger, target_failures or failures)]
+        if not targets:
+            return False
+
+        def fail(operation):
+            for config, target, target_failures in targets:
+                target.valid = False
+                target_failures.append((target.full_title(), operation))
+            return False
+
+        try:
+            files = []
+            if module.source_id is None:
+                logger.error("Module %s has no source id" % module.title)
+                return fail(": module has not source id")
+            logger.info("Copying content for module: %s - %s" % (module.source_id, module.full_title()))
+            if not run_options.dryrun:
+                with tracing.span('download export', module=module.source_id):
+                    files.append(self.source.download_export(module.source_id))
+                if path.exists("%s.zip" % module.source_id):
+                    self.size_cache.set(scheduling.export_key(self.config.source_server, module.source_id),
+                                        path.getsize("%s.zip" % module.source_id))
+                synthesized = run_options.roles and self.config.synthesize_receipts
+                if synthesized:  # the roles are replaced anyway, write the receipt from the export
+                    with tracing.span('synthesize receipt', module=module.source_id):
+                        offload.call(deposit_receipt.write_receipt, "%s.zip" % module.source_id,
+                                     "%s.xml" % module.source_id, module.title, role_config.creators,
+                                     role_config.maintainers, role_config.rightholders)
+                    files.append("%s.xml" % module.source_id)
                 else:
-                    if not regex.search(self.config.destination_server[http_server.end():],
-                                        module.destination_workspace_url[http_workgroup.end():]):
-                        logger.error("Destination workspace does not match destination server! "
-                                     "Destination Server: %s vs. Workspace URL: %s" %
-                                     (self.config.destination_server, module.destination_workspace_url))
-                        module.valid = False
-                        failures.append((module.full_title(), "copying module"))
+                    with tracing.span('download receipt', module=module.source_id):
+                        files.append(self.source.download_receipt(module.source_id))
+                try:
+                    if run_options.roles and not synthesized:
+                        with tracing.span('role rewrite', module=module.source_id):
+                            RoleUpdater(role_config).run_update_roles("%s.xml" % module.source_id)
+                except TerminateError:
+                    raise TerminateError("Terminate Signaled")
+                except (CCTError, Exception) as e:
+                    if type(e) is not CCTError and type(e) is not SkipSignal:
+                        logger.error("Problematic Error")
+                        logger.debug(traceback.format_exc())
+                    if type(e) is SkipSignal:
+                        logger.warn("User skipped creating workgroup.")
+                    logger.error("Failure updating roles on module %s" % module.source_id)
+                    return fail(" updating roles")
+
+                try:
+                    with tracing.span('zip clean', module=module.source_id):
+                        self.clean_zip("%s.zip" % module.source_id)  # remove index.cnxml.html from zipfile
+                except TerminateError:
+                    raise TerminateError("Terminate Signaled")
+                except Exception as e:
+                    logger.debug(traceback.format_exc())
+                    logger.error("Failed cleaning module zipfile %s" % module.title)
+                    return fail(" cleaning module zipfile ")
+                if run_options.verify:
+                    self.source_digests[module.source_id] = verification.zip_digests("%s.zip" % module.source_id)
+                if len(targets) == 1:
+                    results = [self.upload(targets[0], module.source_id)]
+                else:  # fan the deposit out to every destination at the same time
+                    pending = self.fanout.map_async(lambda target: self.upload(target, module.source_id), targets)
+                    while not pending.ready():
+                        pending.wait(0.5)  # a timed wait lets the signal handlers of the main thread run
+                    results = pending.get()
+                uploaded = True
+                for (config, target, target_failures), (res, mpart, url, error) in zip(targets, results):
+                    if mpart:
+                        files.append(mpart)
+                    if error is not None:
+                        logger.debug(error[1])
+                        logger.error("Failed uploading module %s to %s: %s" %
+                                     (target.title, config.destination_server, getattr(error[0], 'msg', error[0])))
+                    elif res.status >= 400:
+                        logger.error("Failed uploading module %s, response %s %s when sending to %s" %
+                                     (target.title, res.status, res.reason, url))
+                    else:
                         continue
-                    try:
-                        files = []
-                        if module.source_id is None:
-                            logger.error("Module %s has no source id" % module.title)
-                            module.valid = False
-                            failures.append((module.full_title(), ": module has not source id"))
-                            continue
-                        logger.info("Copying content for module: %s - %s" % (module.source_id, module.full_title()))
-                        if not run_options.dryrun:
-                            files.append(http.http_download_file("%s/content/%s/latest/module_export?format=zip&nonce=%s" %
-                                                                 (self.config.source_server, module.source_id, getpid()),
-                                                                 module.source_id, '.zip'))
-                            files.append(http.http_download_file("%s/content/%s/latest/rhaptos-deposit-receipt?nonce=%s" %
-                                                                 (self.config.source_server, module.source_id, getpid()),
-                                                                 module.source_id, '.xml'))
-                            try:
-                                if run_options.roles:
-                                    RoleUpdater(role_config).run_update_roles("%s.xml" % module.source_id)
-                            except TerminateError:
-                                raise TerminateError("Terminate Signaled")
-                            except (CCTError, Exception) as e:
-                                if type(e) is not CCTError and type(e) is not SkipSignal:
-                                    logger.error("Problematic Error")
-                                    logger.debug(traceback.format_exc())
-                                if type(e) is SkipSignal:
-                                    logger.warn("User skipped creating workgroup.")
-                                logger.error("Failure updating roles on module %s" % module.source_id)
-                                module.valid = False
-                                failures.append((module.full_title(), " updating roles"))
-                                continue
-
-                            try:
-                                self.clean_zip("%s.zip" % module.source_id)  # remove index.cnxml.html from zipfile
-                            except TerminateError:
-                                raise TerminateError("Terminate Signaled")
-                            except Exception as e:
-                                logger.debug(traceback.format_exc())
-                                logger.error("Failed cleaning module zipfile %s" % module.title)
-                                module.valid = False
-                                failures.append((module.full_title(), " cleaning module zipfile "))
-                                continue
-                            res, mpart, url = http.http_upload_file("%s.xml" % module.source_id,
-                                                                    "%s.zip" % module.source_id,
-                                                                    "%s/%s/sword" % (module.destination_workspace_url,
-                                                                                     module.destination_id),
-                                                                    self.config.credentials)
-                            files.append(mpart)
-                            # clean up temp files
-                            if res.status < 400:
-                                for temp_file in files:
-                                    remove(temp_file)
-                            else:
-                                logger.error("Failed uploading module %s, response %s %s when sending to %s" %
-                                             (module.title, res.status, res.reason, url))
-                                module.valid = False
-                                failures.append((module.full_title(), " uploading module "))
-                    except TerminateError:
-                        raise TerminateError("Terminate Signaled")
-                    except (CCTError, Exception) as e:
-                        if type(e) is not CCTError and type(e) is not SkipSignal:
-                            logger.error("Problematic Error")
-                            logger.debug(traceback.format_exc())
-                        if type(e) is SkipSignal:
-                            logger.warn("User skipped copying module.")
-                        logger.error("Failure copying module %s" % module.source_id)
-                        module.valid = False
-                        failures.append((module.full_title(), "copying module"))
+                    uploaded = False
+                    target.valid = False
+                    target_failures.append((target.full_title(), " uploading module "))
+                # clean up temp files
+                if uploaded:
+                    for temp_file in files:
+                        remove(temp_file)
+        except TerminateError:
+            raise TerminateError("Terminate Signaled")
+        except (CCTError, Exception) as e:
+            if type(e) is not CCTError and type(e) is not SkipSignal:
+                logger.error("Problematic Error")
+                logger.debug(traceback.format_exc())
+            if type(e) is SkipSignal:
+                logger.warn("User skipped copying module.")
+            logger.error("Failure copying module %s" % module.source_id)
+            return fail("copying module")
+        return any(target.valid for config, target, target_failures in targets)
 
 
 class ContentCreator:
-    def __init__(self, server, credentials):
+    def __init__(self, server, credentials, inventory=None):
         self.server = server
         self.credentials = credentials
+        self.inventory = inventory  # an inventory.Inventory of existing workgroups and modules, optional
+        self.licenses = {}  # (host, username) -> license accepted in the creation wizard
+        self.fast_wizard = {}  # host -> False once the cached license was not accepted there
 
     def run_create_workgroup(self, workgroup, server, credentials, logger, dryrun=False):
         """
@@ -218,9 +474,17 @@ class ContentCreator:
         Returns:
           the ID of the created workgroup object, id='wg00000' if dryrun
         """
+        if self.inventory is not None:
+            existing = self.inventory.find_workgroup(server, workgroup.title)
+            if existing is not None:
+                workgroup.id, workgroup.url = existing
+                logger.info("Workgroup %s exists on %s: %s" % (workgroup.title, server, workgroup.url))
+                return
         logger.info("Creating workgroup: %s on %s" % (workgroup.title, server))
         if not dryrun:
             self.create_workgroup(workgroup, server, credentials, logger)
+            if self.inventory is not None:
+                self.inventory.add_workgroup(server, workgroup.title, workgroup.id, workgroup.url)
 
     def create_workgroup(self, workgroup, server, credentials, logger):
         """
@@ -273,12 +537,21 @@ class ContentCreator:
             workgroup_url += credentials.split(':')[0]
             workgroup_url = "%s/%s" % (server, workgroup_url)
             info_str += " in Personal workspace (%s)" % workgroup_url
+        if self.inventory is not None:
+            existing = self.inventory.find_module(server, workgroup_url, module.chapter_number, module.title)
+            if existing is not None:
+                logger.info("Module %s exists in %s: %s" % (module.title, workgroup_url, existing))
+                module.destination_workspace_url = workgroup_url
+                module.destination_id = existing
+                return
         logger.info(info_str)
         if not dryrun:
             temp_url = self.create_module(module.title, credentials, workgroup_url, logger)
             res, url = self.publish_module(temp_url, credentials, logger)
             module.destination_workspace_url = workgroup_url
             module.destination_id = res
+            if self.inventory is not None:
+                self.inventory.add_module(server, workgroup_url, module.chapter_number, module.title, res)
 
     def create_module(self, title, credentials, workspace_url, logger):
         """
@@ -293,28 +566,22 @@ class ContentCreator:
 
         data1 = {"type_name": "Module",
                  "workspace_factories:method": "Create New Item"}
-
-        response1 = http.http_post_request(workspace_url, auth=auth, data=data1)
-        if not http.verify(response1, logger):
-            raise CCTError("create module for %s request 1 failed: %s %s" %
-                           (title, response1.status_code, response1.reason))
-        cc_license = self.get_license(response1, logger)
         data2 = {"agree": "on",
                  "form.button.next": "Next >>",
-                 "license": cc_license,
                  "form.submitted": "1"}
+        cc_license, response2 = self.accept_license(workspace_url, data1, data2, auth, logger,
+                                                    "create module for %s" % title)
         data3 = {"title": title,
                  "master_language": "en",
                  "language": "en",
                  "license": cc_license,
                  "form.button.next": "Next >>",
                  "form.submitted": "1"}
-        response2 = http.http_post_request(response1.url.encode('UTF-8'), auth=auth, data=data2)
-        if not http.verify(response2, logger):
-            raise CCTError("create module for %s request 2 failed: %s %s" %
-                           (title, response2.status_code, response2.reason))
         r2url = response2.url.encode('UTF-8')
-        create_url = r2url[:regex.search('cc_license', r2url).start()]
+        match = regex.search('cc_license', r2url)
+        if match is None:
+            raise CCTError("create module for %s request 2 failed: unexpected wizard url %s" % (title, r2url))
+        create_url = r2url[:match.start()]
         response3 = http.http_post_request("%scontent_title" % create_url, auth=auth, data=data3)
         if not http.verify(response3, logger):
             raise CCTError("create module for %s request 3 failed: %s %s" %
@@ -351,11 +618,58 @@ class ContentCreator:
         else:
             return module_url[module_url.rfind('/', 0, -1) + 1:-1], module_url
 
+    def accept_license(self, create_url, create_data, agree_data, auth, logger, description):
+        """
+        Starts the creation wizard at [create_url] and accepts the license.
+
+        The license is read from the first wizard page once per host and user
+        and cached. With a cached license the wizard page is not read at all:
+        the license is posted straight to the url the creation ends up at after
+        its redirects. If the server does not accept that (it answers with the
+        license page again instead of the next step of the wizard), the page is
+        read step by step and the fast path is not used for that host again.
+
+        Returns:
+            The license and the response to the license acceptance.
+        """
+        host = urlparse(create_url).netloc.lower()
+        key = (host, auth[0])
+        response1 = None
+        if key in self.licenses and self.fast_wizard.get(host, True):
+            response0 = http.http_post_request(create_url, auth=auth, data=create_data, stream=True)
+            if not http.verify(response0, logger):
+                raise CCTError("%s request 1 failed: %s %s" % (description, response0.status_code, response0.reason))
+            wizard_url = response0.url.encode('UTF-8')  # after all the redirects
+            response0.close()  # the wizard page itself is not read
+            agree_data['license'] = self.licenses[key]
+            response2 = http.http_post_request(wizard_url, auth=auth, data=agree_data)
+            if http.verify(response2, logger) and not parsing.license_rejected(response2):
+                return self.licenses[key], response2
+            logger.debug("Cached license %s was not accepted by %s, reading the wizard page" %
+                         (self.licenses[key], host))
+            self.fast_wizard[host] = False
+            del self.licenses[key]
+            response1 = http.http_get_request(wizard_url, auth=auth, stream=True)
+        if response1 is None:
+            response1 = http.http_post_request(create_url, auth=auth, data=create_data, stream=True)
+        if not http.verify(response1, logger):
+            raise CCTError("%s request 1 failed: %s %s" % (description, response1.status_code, response1.reason))
+        cc_license = self.get_license(response1, logger)
+        agree_data['license'] = cc_license
+        response2 = http.http_post_request(response1.url.encode('UTF-8'), auth=auth, data=agree_data)
+        if not http.verify(response2, logger):
+            raise CCTError("%s request 2 failed: %s %s" % (description, response2.status_code, response2.reason))
+        if parsing.license_rejected(response2):
+            raise CCTError("%s request 2 failed: license %s was not accepted" % (description, cc_license))
+        self.licenses[key] = cc_license
+        return cc_license, response2
+
     def get_license(self, response, logger):
         try:
-            html = response.text.encode('UTF-8', 'ignore')
-            start = regex.search(r'<input\s*type="hidden"\s*name="license"\s*value="', html)
-            return html[start.end():html.find('"', start.end())]
+            cc_license = parsing.find_license(response)
+            if cc_license is None:
+                raise CCTError("no license field on %s" % response.url)
+            return cc_license
         except TerminateError:
             raise TerminateError("Terminate Signaled")
         except Exception as e:
@@ -368,16 +682,12 @@ class ContentCreator:
         auth = tuple(credentials.split(':'))
         data0 = {"type_name": "Collection",
                  "workspace_factories:method": "Create New Item"}
-        response0 = http.http_post_request("%s/Members/%s" % (server, auth[0]), auth=auth, data=data0)
-        if not http.verify(response0, logger):
-            raise CCTError("Creation of collection %s request 2 failed: %s %s" %
-                           (title, response0.status_code, response0.reason))
-        cc_license = self.get_license(response0, logger)
         data1 = {"agree": "on",
                  "form.button.next": "Next >>",
-                 "license": cc_license,
                  "type_name": "Collection",
                  "form.submitted": "1"}
+        cc_license, response1 = self.accept_license("%s/Members/%s" % (server, auth[0]), data0, data1, auth, logger,
+                                                    "Creation of collection %s" % title)
         data2 = {"title": title,
                  "master_language": "en",
                  "language": "en",
@@ -387,10 +697,6 @@ class ContentCreator:
                  "license": cc_license,
                  "form.button.next": "Next >>",
                  "form.submitted": "1"}
-        response1 = http.http_post_request(response0.url, auth=auth, data=data1)
-        if not http.verify(response1, None):
-            raise CCTError("Creation of collection %s request 2 failed: %s %s" %
-                           (title, response1.status_code, response1.reason))
         url = response1.url
         base = url[:url.rfind('/')+1]
         response2 = http.http_post_request("%s/content_title" % base, auth=auth, data=data2)
@@ -412,17 +718,13 @@ class ContentCreator:
         if not http.verify(response, logger):
             raise CCTError("Creation of subcollection(s) %s request failed: %s %s" %
                            (titles, response.status_code, response.reason))
-        text = response.text[len("close:["):-1]
-        text = text.split("},{")
+        try:
+            nodes = parsing.parse_composer_response(response.text)
+        except ValueError as e:
+            raise CCTError("Creation of subcollection(s) %s returned an unexpected response: %s" % (titles, e))
         subcollections = []
-        for subcollection_response in text:
-            subcollection_id_start = regex.search(r'nodeid\':\'', subcollection_response).end()
-            subcollection_id = subcollection_response[subcollection_id_start:
-                                                      subcollection_response.find("'", subcollection_id_start)]
-            subcollection_title_start = regex.search(r'text\':\s*\'', subcollection_response).end()
-            subcollection_title = subcollection_response[subcollection_title_start:
-                                                         subcollection_response.find("'", subcollection_title_start)]
-            subcollection = Collection(subcollection_title, subcollection_id)
+        for node in nodes:
+            subcollection = Collection(node['text'].encode('UTF-8'), node['nodeid'].encode('UTF-8'))
             subcollection.parent = collection
             collection.add_member(subcollection)
             subcollections.append(subcollection)
@@ -441,8 +743,9 @@ class ContentCreator:
             if not module.valid:
                 continue
             data["ids:list"] = module.destination_id
-            response = http.http_post_request("%s/Members/%s/%s/@@collection-composer-collection-module" %
-                                              (server, auth[0], collection_url), auth=auth, data=data)
+            with tracing.span('collection add', module=module.destination_id):
+                response = http.http_post_request("%s/Members/%s/%s/@@collection-composer-collection-module" %
+                                                  (server, auth[0], collection_url), auth=auth, data=data)
             if not http.verify(response, logger):
                 logger.error("Module %s failed to be added to collection %s" % (module.title, collection.title))
                 module.valid = False
@@ -0,0 +1,132 @@
+import shutil
+import threading
+from os import path, rename
+from tempfile import mkdtemp
+
+"""
+This file contains the prefetching source of the content-copy-tool.
+
+While the summary waits for the user to confirm the run, the export zips (and
+deposit receipts) of the first modules to copy are downloaded into a hidden
+temporary directory of the working directory. Only downloads are made before the run is confirmed.
+The copier takes the prefetched files instead of downloading them again; a
+module whose download has not started yet is downloaded by the copier as
+usual. Cancelling the run discards the prefetched files.
+"""
+
+WORKERS = 2
+
+QUEUED, RUNNING, DONE, CLAIMED = 'queued', 'running', 'done', 'claimed'
+
+
+class Prefetch:
+    """ The state of one prefetched file. """
+    def __init__(self):
+        self.state = QUEUED
+        self.filename = None
+        self.done = threading.Event()
+
+
+class PrefetchSource:
+    """
+    Stands in for a LiveSource: downloads the files of [source_ids] ahead
+    with start() and hands them to the copier when it asks for them.
+    """
+    def __init__(self, source, source_ids, receipts=True, workers=WORKERS):
+        self.source = source
+        self.source_server = source.source_server
+        self.extensions = ['.zip', '.xml'] if receipts else ['.zip']  # receipts are not needed when synthesized
+        self.source_ids = source_ids
+        self.workers = workers
+        self.directory = None
+        self.pool = None
+        self.files = {}  # (source id, extension) -> Prefetch
+        self.lock = threading.Lock()
+
+    def has(self, source_id):
+        return self.source.has(source_id)
+
+    def export_sizes(self, modules, cache, workers):
+        return self.source.export_sizes(modules, cache, workers)
+
+    def start(self):
+        """ Starts downloading the files in the background. """
+        from multiprocessing.pool import ThreadPool
+        if not self.source_ids:
+            return
+        self.directory = mkdtemp('.prefetch', '.cct', '.')  # next to the files of the copier, for the renames
+        for source_id in self.source_ids:
+            for extension in self.extensions:
+                self.files[(source_id, extension)] = Prefetch()
+        self.pool = ThreadPool(self.workers)
+        for source_id in self.source_ids:
+            for extension in self.extensions:
+                self.pool.apply_async(self.fetch, (source_id, extension))
+        self.pool.close()
+
+    def fetch(self, source_id, extension):
+        prefetch = self.files[(source_id, extension)]
+        with self.lock:
+            if prefetch.state != QUEUED:
+                return  # the copier got there first
+            prefetch.state = RUNNING
+        try:
+            download = self.source.download_export if extension == '.zip' else self.source.download_receipt
+            filename = download(source_id, self.directory)
+            prefetch.filename = filename if path.exists(filename) else None
+        except Exception:
+            prefetch.filename = None  # the copier downloads it again and reports the failure
+        finally:
+            prefetch.state = DONE
+            prefetch.done.set()
+
+    def take(self, source_id, extension):
+        """ Returns the name of the file in the current directory, prefetched or downloaded now. """
+        prefetch = self.files.get((source_id, extension))
+        if prefetch is not None:
+            with self.lock:
+                waiting = prefetch.state in (RUNNING, DONE)
+                if not waiting:
+                    prefetch.state = CLAIMED
+            if waiting:
+                while not prefetch.done.wait(0.5):  # a timed wait lets the signal handlers of the main thread run
+                    pass
+                if prefetch.filename:
+                    rename(prefetch.filename, "%s%s" % (source_id, extension))
+                    prefetch.filename = None
+                    return "%s%s" % (source_id, extension)
+        if extension == '.zip':
+            return self.source.download_export(source_id)
+        return self.source.download_receipt(source_id)
+
+    def download_export(self, source_id):
+        return self.take(source_id, '.zip')
+
+    def download_receipt(self, source_id):
+        return self.take(source_id, '.xml')
+
+    def prefetched(self):
+        """ Returns the number of files downloaded so far. """
+        return len([prefetch for prefetch in self.files.values() if prefetch.state == DONE])
+
+    def cancel(self):
+        """
+        Stops the downloads that have not started, waits for the ones that run
+        (they write to the directory) and removes the prefetched files.
+        """
+        with self.lock:
+            for prefetch in self.files.values():
+                if prefetch.state == QUEUED:
+                    prefetch.state = CLAIMED
+        for prefetch in self.files.values():
+            if prefetch.state == RUNNING:
+                while not prefetch.done.wait(0.5):  # a timed wait lets the signal handlers of the main thread run
+                    pass
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    close = cancel  # after the run, the files that were not used are discarded the same way
@@ -0,0 +1,148 @@
+import traceback
+from urlparse import urlparse
+
+import http_util as http
+import scheduling
+from util import TerminateError
+
+"""
+This file contains the preflight check of the content-copy-tool.
+
+While the summary waits for the user to confirm the run, every selected
+module is looked up with a HEAD request, concurrently: the export of its
+source module on the source server and its destination module in its
+workspace. Modules whose source or destination is gone are reported and
+left out of the run, so they fail before the copy instead of in the middle of
+it. Modules that are redirected elsewhere are reported as moved. The export
+sizes found are reported as well and kept in the size cache of the copier.
+"""
+
+MISSING = (404, 410)
+
+
+def source_url(source_server, source_id):
+    return "%s/content/%s/latest/module_export?format=zip" % (source_server, source_id)
+
+
+def destination_url(module):
+    return "%s/%s" % (module.destination_workspace_url.rstrip('/'), module.destination_id)
+
+
+def moved(url, response):
+    """ Returns the url the request of url was redirected to if it is not the same resource, or None. """
+    final_url = getattr(response, 'url', None) or url
+    if urlparse(final_url).path.rstrip('/') == urlparse(url).path.rstrip('/'):
+        return None
+    return final_url
+
+
+class Preflight:
+    """
+    The HEAD requests of the modules of the destinations (Destination objects),
+    run by [workers] threads between start() and finish().
+    """
+    def __init__(self, destinations, run_options, source, workers=8):
+        self.destinations = destinations
+        self.run_options = run_options
+        self.source = source  # the copier's, a bundle is not probed
+        self.workers = workers
+        self.probes = []  # (kind, url, auth), each once
+        self.modules = {}  # probe -> the (destination, module) pairs it checks
+        self.plan()
+        self.pool = None
+        self.result = None
+
+    def add(self, probe, destination, module):
+        if probe not in self.modules:
+            self.probes.append(probe)
+            self.modules[probe] = []
+        self.modules[probe].append((destination, module))
+
+    def plan(self):
+        run_options = self.run_options
+        live_source = hasattr(self.source, 'source_server')  # a bundle has been checked by the validation
+        placeholders = run_options.modules or run_options.workgroups
+        for destination in self.destinations:
+            auth = tuple(destination.copy_config.credentials.split(':'))
+            for module in destination.bookmap.bookmap.modules:
+                if not module.valid or module.chapter_number not in destination.bookmap.chapters:
+                    continue
+                if (run_options.copy or run_options.export_bundle) and live_source and module.source_id:
+                    self.add(('source', source_url(self.source.source_server, module.source_id), ()),
+                             destination, module)
+                if (run_options.copy or run_options.publish or run_options.collections) and not placeholders \
+                        and module.destination_id and module.destination_workspace_url:
+                    self.add(('destination', destination_url(module), auth), destination, module)
+
+    def probe(self, target):
+        kind, url, auth = target
+        try:
+            response = http.http_head_request(url, auth=auth)
+            length = response.headers.get('Content-Length')
+            return (response.status_code, int(length) if kind == 'source' and length else None,
+                    moved(url, response), None)
+        except TerminateError:
+            raise
+        except Exception as e:
+            return None, None, None, (e, traceback.format_exc())
+
+    def start(self):
+        if not self.probes:
+            return
+        from multiprocessing.pool import ThreadPool
+        self.pool = ThreadPool(max(1, min(self.workers, len(self.probes))))
+        self.result = self.pool.map_async(self.probe, self.probes)
+        self.pool.close()
+
+    def cancel(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def finish(self, logger, size_cache=None):
+        """
+        Waits for the probes, logs what they found and marks the modules whose
+        source or destination module is missing invalid.
+
+        Returns:
+            The number of modules that were left out.
+        """
+        if self.pool is None:
+            return 0
+        while not self.result.ready():
+            self.result.wait(0.5)  # a timed wait lets the signal handlers of the main thread run
+        self.pool.join()
+        self.pool = None
+        dropped = 0
+        unanswered = 0
+        sizes = {}
+        for probe, (status, size, moved_to, error) in zip(self.probes, self.result.get()):
+            kind, url = probe[:2]
+            if error is not None:
+                unanswered += 1
+                logger.debug("Preflight request %s failed: %s" % (url, error[1]))
+                continue
+            if size is not None and size_cache is not None:
+                size_cache.set(scheduling.export_key(self.source.source_server,
+                                                     self.modules[probe][0][1].source_id), size)
+            for destination, module in self.modules[probe]:
+                where = "Preflight%s: chapter %s, module [%s]" % (
+                    " (%s)" % destination.copy_config.name if destination.copy_config.name else "",
+                    module.chapter_number, module.title)
+                if size is not None:
+                    sizes[module.source_id] = size
+                if status in MISSING:
+                    logger.warn("\033[91m%s: %s module not found (%s), it is left out\033[0m" % (where, kind, status))
+                    if module.valid:
+                        module.valid = False
+                        dropped += 1
+                        destination.failures.append((module.full_title(), "preflight check (%s module not found)" %
+                                                     kind))
+                elif status >= 400:
+                    logger.warn("%s: %s module answered %s" % (where, kind, status))
+                elif moved_to:
+                    logger.warn("%s: %s module moved to %s" % (where, kind, moved_to))
+        logger.info("Preflight: %d requests, \033[95m%d\033[0m modules left out, %d not answered, "
+                    "\033[95m%.1f MB\033[0m of source exports for %d modules" %
+                    (len(self.probes), dropped, unanswered, sum(sizes.values()) / (1024.0 * 1024), len(sizes)))
+        return dropped
@@ -0,0 +1,129 @@
+import os
+from contextlib import contextmanager
+
+"""
+This file contains the CPU profiling support for the content-copy-tool.
+
+Each phase of a run (parse, placeholders, copy, roles, collection, publish) is
+profiled separately. For every phase the profiler writes:
+
+    [phase].prof       - the raw cProfile stats (load with pstats or snakeviz)
+    [phase].collapsed  - collapsed stacks, one "frame;frame;frame microseconds"
+                         line per stack, for flamegraph.pl / speedscope
+
+and all.collapsed combines every phase under a root frame named after it.
+"""
+
+
+class PhaseProfiler:
+    """ Profiles the phases of a run, does nothing if output_dir is None. """
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.phases = []
+        if output_dir and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    @contextmanager
+    def phase(self, name):
+        """ Profiles the body of the with statement as the phase [name]. """
+        if not self.output_dir:
+            yield
+            return
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self.save(name, profiler)
+
+    def save(self, name, profiler):
+        """ Writes the stats and collapsed stacks of the finished phase. """
+        import pstats
+        stats_file = os.path.join(self.output_dir, '%s.prof' % name)
+        profiler.dump_stats(stats_file)
+        stacks = collapse_stacks(pstats.Stats(stats_file).stats)
+        write_collapsed(os.path.join(self.output_dir, '%s.collapsed' % name), stacks)
+        self.phases.append((name, stats_file, stacks))
+        combined = {}
+        for phase_name, _, phase_stacks in self.phases:
+            for stack, micros in phase_stacks.iteritems():
+                combined["%s;%s" % (phase_name, stack)] = micros
+        write_collapsed(os.path.join(self.output_dir, 'all.collapsed'), combined)
+
+    def report(self, logger, limit=15):
+        """ Logs the functions with the highest own CPU time over all phases. """
+        if not self.phases:
+            return
+        import pstats
+        logger.info("-------- Profile ----------------------------------------")
+        for name, stats_file, stacks in self.phases:
+            logger.info("Phase %s: %.3fs CPU" % (name, sum(stacks.itervalues()) / 1e6))
+        stats = pstats.Stats(self.phases[0][1])
+        for _, stats_file, _ in self.phases[1:]:
+            stats.add(stats_file)
+        top = sorted(stats.stats.iteritems(), key=lambda item: item[1][2], reverse=True)[:limit]
+        logger.info("Top functions by own time (own / cumulative / calls):")
+        for func, (cc, nc, tt, ct, callers) in top:
+            logger.info("  %8.3fs %8.3fs %8d  %s" % (tt, ct, nc, frame_label(func)))
+        logger.info("Profiles written to: \033[95m%s\033[0m" % self.output_dir)
+
+
+def frame_label(func):
+    """ Formats a pstats function key (filename, line, name) as a flame graph frame. """
+    filename, line, name = func
+    if filename == '~':  # built-in function
+        return name.replace(';', ',')
+    return ("%s (%s:%d)" % (name, os.path.basename(filename), line)).replace(';', ',')
+
+
+def collapse_stacks(stats, max_depth=64):
+    """
+    Converts pstats data into collapsed stacks.
+
+    cProfile only records caller/callee edges, so the time of a function that
+    is reached from several callers is split between them in proportion to the
+    cumulative time of each edge.
+
+    Returns:
+        A dictionary mapping "frame;frame;..." to microseconds of own time.
+    """
+    callees = {}
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.iteritems():
+        if not [caller for caller in callers if caller in stats]:
+            roots.append(func)
+        for caller, edge in callers.iteritems():
+            callees.setdefault(caller, {})[func] = edge[3] if isinstance(edge, tuple) else 0
+
+    stacks = {}
+
+    def walk(func, frames, scale, on_stack):
+        own = stats[func][2] * scale
+        frames = frames + [frame_label(func)]
+        if own > 0:
+            key = ';'.join(frames)
+            stacks[key] = stacks.get(key, 0) + own
+        if len(frames) >= max_depth:
+            return
+        for callee, edge_time in callees.get(func, {}).iteritems():
+            callee_total = stats[callee][3]
+            if callee in on_stack or callee_total <= 0 or edge_time <= 0:
+                continue
+            callee_scale = scale * edge_time / callee_total
+            if callee_scale * callee_total < 1e-6:
+                continue
+            walk(callee, frames, callee_scale, on_stack | set([callee]))
+
+    for root in roots:
+        walk(root, [], 1.0, set([root]))
+    return dict((stack, int(round(seconds * 1e6))) for stack, seconds in stacks.iteritems()
+                if seconds * 1e6 >= 1)
+
+
+def write_collapsed(filename, stacks):
+    """ Writes collapsed stacks in the format flamegraph.pl expects. """
+    with open(filename, 'w') as out:
+        for stack in sorted(stacks):
+            out.write("%s %d\n" % (stack, stacks[stack]))
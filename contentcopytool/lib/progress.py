@@ -0,0 +1,153 @@
+import logging
+import sys
+import threading
+import time
+from collections import deque
+
+"""
+This file contains the progress reporting of the content-copy-tool.
+
+The reporter counts the modules done per phase and listens to the HTTP layer
+(see http_util.listeners) for the bytes moved and the requests in flight. On
+a terminal it keeps a status line up to date, otherwise it logs the status
+every [interval] seconds.
+"""
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return "%dh%02dm" % (seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return "%dm%02ds" % (seconds // 60, seconds % 60)
+    return "%ds" % seconds
+
+
+class ProgressReporter:
+    """ Reports modules done, throughput, requests in flight and an ETA for the current phase. """
+    def __init__(self, logger, stream=sys.stderr, interval=30, window=20, throughput_window=30, observers=None):
+        self.logger = logger
+        self.observers = observers or []  # objects with a module_done(phase, ok, remaining) method
+        self.stream = stream
+        self.tty = hasattr(stream, 'isatty') and stream.isatty()
+        self.interval = interval if not self.tty else 0.5
+        self.window = window
+        self.throughput_window = throughput_window
+        self.lock = threading.RLock()
+        self.phase = None
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.completions = deque(maxlen=window)
+        self.transfers = deque()  # (time, bytes down, bytes up)
+        self.in_flight = 0
+        self.last_report = 0
+        self.line_shown = False
+        if self.tty:
+            for handler in logger.handlers:
+                if isinstance(handler, logging.StreamHandler) and getattr(handler, 'stream', None) is stream:
+                    handler.addFilter(StatusLineClearer(self))
+
+    def start_phase(self, name, total):
+        with self.lock:
+            self.phase = name
+            self.total = total
+            self.done = 0
+            self.failed = 0
+            self.completions.clear()
+            self.completions.append(time.time())
+            self.last_report = 0
+            self.report()
+
+    def finish_phase(self):
+        with self.lock:
+            if self.phase is None:
+                return
+            self.report(force=True)
+            if self.tty and self.line_shown:
+                self.stream.write('\n')
+                self.stream.flush()
+                self.line_shown = False
+            self.phase = None
+
+    def module_done(self, ok=True):
+        with self.lock:
+            self.done += 1
+            if not ok:
+                self.failed += 1
+            self.completions.append(time.time())
+            self.report()
+            for observer in self.observers:
+                observer.module_done(self.phase, ok, max(self.total - self.done, 0))
+
+    def request_started(self, kind, url):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self, kind, url, status, bytes_down, bytes_up, elapsed):
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if bytes_down or bytes_up:
+                self.transfers.append((time.time(), bytes_down, bytes_up))
+            self.report()
+
+    def modules_per_second(self):
+        if len(self.completions) < 2:
+            return 0.0
+        span = self.completions[-1] - self.completions[0]
+        return (len(self.completions) - 1) / span if span > 0 else 0.0
+
+    def throughput(self):
+        """ Returns the (download, upload) bytes per second over the throughput window. """
+        now = time.time()
+        while self.transfers and self.transfers[0][0] < now - self.throughput_window:
+            self.transfers.popleft()
+        if not self.transfers:
+            return 0.0, 0.0
+        span = max(now - self.transfers[0][0], 1.0)
+        return (sum(down for _, down, _ in self.transfers) / span,
+                sum(up for _, _, up in self.transfers) / span)
+
+    def status(self):
+        rate = self.modules_per_second()
+        remaining = max(self.total - self.done, 0)
+        eta = format_duration(remaining / rate) if rate and remaining else ('-' if remaining else '0s')
+        down, up = self.throughput()
+        percent = 100.0 * self.done / self.total if self.total else 100.0
+        failed = ", %d failed" % self.failed if self.failed else ""
+        return ("[%s] %d/%d modules (%.0f%%%s), %d remaining | %.2f modules/s | down %.2f MB/s, up %.2f MB/s | "
+                "%d in flight | ETA %s" % (self.phase, self.done, self.total, percent, failed, remaining, rate,
+                                           down / 1e6, up / 1e6, self.in_flight, eta))
+
+    def report(self, force=False):
+        if self.phase is None:
+            return
+        now = time.time()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        if self.tty:
+            self.stream.write("\r\033[K\033[96m%s\033[0m" % self.status())
+            self.stream.flush()
+            self.line_shown = True
+        else:
+            self.logger.info(self.status())
+
+    def clear_line(self):
+        """ Removes the status line so a log line can be written in its place. """
+        with self.lock:
+            if self.line_shown:
+                self.stream.write("\r\033[K")
+                self.line_shown = False
+                self.last_report = 0  # redraw it with the next update
+
+
+class StatusLineClearer(logging.Filter):
+    """ Clears the status line before the console handler writes a log record. """
+    def __init__(self, reporter):
+        logging.Filter.__init__(self)
+        self.reporter = reporter
+
+    def filter(self, record):
+        self.reporter.clear_line()
+        return True
@@ -0,0 +1,219 @@
+import codecs
+import re as regex
+
+"""
+This file contains the parsers for the responses of the Plone/Rhaptos
+servers.
+
+The patterns are compiled once. Pages are read from the response as a stream
+of chunks, so a search stops reading (and closes the response) as soon as the
+token it is looking for has been found instead of decoding the whole page.
+"""
+
+LICENSE_PATTERN = regex.compile(r'<input\s*type="hidden"\s*name="license"\s*value="([^"]*)"')
+AGREE_PATTERN = regex.compile(r'<input[^>]*\sname="agree"')
+ROLE_REQUEST_ID_PATTERN = regex.compile(r'name="ids:list"\s*value="([^"]*)"')
+
+CHUNK_SIZE = 16 * 1024
+OVERLAP = 1024  # longest match that may span two chunks
+
+
+def iter_text(response, chunk_size=CHUNK_SIZE):
+    """ Yields the body of the response as decoded text chunks. """
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    for chunk in response.iter_content(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode('', final=True)
+
+
+def search_stream(response, pattern):
+    """
+    Returns the first match of the pattern in the response body, or None.
+    Reading stops at the chunk that contains the match.
+    """
+    buf = u''
+    try:
+        for text in iter_text(response):
+            buf += text
+            match = pattern.search(buf)
+            if match:
+                return match
+            buf = buf[-OVERLAP:]
+    finally:
+        response.close()
+    return None
+
+
+def finditer_stream(response, pattern):
+    """ Yields every match of the pattern in the response body, reading it chunk by chunk. """
+    buf = u''
+    try:
+        for text in iter_text(response):
+            buf += text
+            cut = max(0, len(buf) - OVERLAP)
+            for match in pattern.finditer(buf):
+                if match.end() > len(buf) - OVERLAP:
+                    cut = match.start()  # might continue in the next chunk, look at it again
+                    break
+                yield match
+                cut = max(cut, match.end())
+            buf = buf[cut:]
+        for match in pattern.finditer(buf):
+            yield match
+    finally:
+        response.close()
+
+
+def find_license(response):
+    """ Returns the license url of a content creation wizard page, or None. """
+    match = search_stream(response, LICENSE_PATTERN)
+    if match:
+        return match.group(1).encode('UTF-8')
+    return None
+
+
+def license_rejected(response):
+    """
+    Returns whether the response to a license agreement is the license page
+    of the wizard again (it still asks to agree), instead of its next step.
+    """
+    return search_stream(response, AGREE_PATTERN) is not None
+
+
+def find_role_request_ids(response):
+    """ Returns the ids of the pending role requests on the collaborations page. """
+    return [match.group(1).encode('UTF-8') for match in finditer_stream(response, ROLE_REQUEST_ID_PATTERN)]
+
+
+def parse_composer_response(text):
+    """
+    Parses a collection composer response, e.g.
+
+        close:[{'nodeid':'col10001','text':'Chapter 1', ...},{...}]
+
+    and returns the list of nodes as dictionaries.
+    """
+    start = min([index for index in (text.find('['), text.find('{')) if index >= 0] or [-1])
+    if start < 0:
+        raise ValueError("No nodes in composer response: %s" % text[:100])
+    value, _ = JSLiteralParser(text, start).parse()
+    if isinstance(value, dict):
+        return [value]
+    return value
+
+
+class JSLiteralParser:
+    """
+    Parses javascript object literals as they are returned by the composer:
+    single or double quoted strings, bare or quoted keys, numbers, true,
+    false and null.
+    """
+    ESCAPES = {'n': u'\n', 't': u'\t', 'r': u'\r', 'b': u'\b', 'f': u'\f', '/': u'/'}
+    NUMBER = regex.compile(r'-?\d+(\.\d+)?([eE][-+]?\d+)?')
+    IDENTIFIER = regex.compile(r'[A-Za-z_$][\w$]*')
+    WHITESPACE = regex.compile(r'\s*')
+
+    def __init__(self, text, position=0):
+        self.text = text
+        self.position = position
+
+    def parse(self):
+        """ Returns the parsed value and the position after it. """
+        return self.value(), self.position
+
+    def skip(self):
+        self.position = self.WHITESPACE.match(self.text, self.position).end()
+
+    def error(self, expected):
+        return ValueError("Expected %s at %d in composer response: %s" %
+                          (expected, self.position, self.text[self.position:self.position + 40]))
+
+    def value(self):
+        self.skip()
+        char = self.text[self.position:self.position + 1]
+        if char == '{':
+            return self.object()
+        if char == '[':
+            return self.array()
+        if char in ('"', "'"):
+            return self.string()
+        number = self.NUMBER.match(self.text, self.position)
+        if number:
+            self.position = number.end()
+            return float(number.group(0)) if number.group(1) or number.group(2) else int(number.group(0))
+        identifier = self.IDENTIFIER.match(self.text, self.position)
+        if identifier and identifier.group(0) in ('true', 'false', 'null'):
+            self.position = identifier.end()
+            return {'true': True, 'false': False, 'null': None}[identifier.group(0)]
+        raise self.error("a value")
+
+    def object(self):
+        result = {}
+        self.position += 1
+        self.skip()
+        if self.text.startswith('}', self.position):
+            self.position += 1
+            return result
+        while True:
+            self.skip()
+            if self.text[self.position:self.position + 1] in ('"', "'"):
+                key = self.string()
+            else:
+                identifier = self.IDENTIFIER.match(self.text, self.position)
+                if not identifier:
+                    raise self.error("a key")
+                key = identifier.group(0)
+                self.position = identifier.end()
+            self.skip()
+            if not self.text.startswith(':', self.position):
+                raise self.error("':'")
+            self.position += 1
+            result[key] = self.value()
+            self.skip()
+            if self.text.startswith(',', self.position):
+                self.position += 1
+            elif self.text.startswith('}', self.position):
+                self.position += 1
+                return result
+            else:
+                raise self.error("',' or '}'")
+
+    def array(self):
+        result = []
+        self.position += 1
+        self.skip()
+        if self.text.startswith(']', self.position):
+            self.position += 1
+            return result
+        while True:
+            result.append(self.value())
+            self.skip()
+            if self.text.startswith(',', self.position):
+                self.position += 1
+            elif self.text.startswith(']', self.position):
+                self.position += 1
+                return result
+            else:
+                raise self.error("',' or ']'")
+
+    def string(self):
+        quote = self.text[self.position]
+        self.position += 1
+        chars = []
+        while self.position < len(self.text):
+            char = self.text[self.position]
+            if char == quote:
+                self.position += 1
+                return u''.join(chars)
+            if char == '\\':
+                escaped = self.text[self.position + 1:self.position + 2]
+                if escaped == 'u':
+                    chars.append(unichr(int(self.text[self.position + 2:self.position + 6], 16)))
+                    self.position += 6
+                    continue
+                chars.append(self.ESCAPES.get(escaped, escaped))
+                self.position += 2
+                continue
+            chars.append(char)
+            self.position += 1
+        raise self.error("end of string")
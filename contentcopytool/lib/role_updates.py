@@ -5,11 +5,31 @@ import re as regex
 import traceback
 from util import CCTError, SkipSignal, TerminateError
 import http_util as http
+import response_parsing as parsing
+import offload
 
 """
 This file contains the Role Updating related object.
 """
 
+def update_roles(file_path, replace_map):
+    """
+    Reads through the input file and replaces content according to the replace map
+
+    The replace_map is a list of tuples: (pattern, substitute text)
+    """
+    fh, abs_path = mkstemp()
+    with open(abs_path, 'w') as new_file:
+        with open(file_path) as old_file:
+            for line in old_file:
+                for pattern, subst in replace_map:
+                    line = regex.sub(pattern, subst, line)
+                new_file.write(line)
+    close(fh)
+    remove(file_path)  # Remove original file
+    move(abs_path, file_path)  # Move new file
+
+
 class RoleConfiguration:
     """ Holds  """
     def __init__(self, creators, maintainers, rightholders, settings, credentials):
@@ -29,19 +49,11 @@ class RoleUpdater:
     def update_roles(self, file_path, replace_map):
         """
         Reads through the input file and replaces content according to the replace map
+        (in the process pool, if started).
 
         The replace_map is a list of tuples: (pattern, substitute text)
         """
-        fh, abs_path = mkstemp()
-        with open(abs_path, 'w') as new_file:
-            with open(file_path) as old_file:
-                for line in old_file:
-                    for pattern, subst in replace_map:
-                        line = regex.sub(pattern, subst, line)
-                    new_file.write(line)
-        close(fh)
-        remove(file_path)  # Remove original file
-        move(abs_path, file_path)  # Move new file
+        offload.call(update_roles, file_path, replace_map)
 
     def prepare_role_updates(self):
         """
@@ -89,19 +101,12 @@ class RoleUpdater:
         return replace_map
 
     def get_pending_roles_request_ids(self, copy_config, credentials, logger):
-        ids = []
         auth = tuple(credentials.split(':'))
-        response1 = http.http_get_request("%s/collaborations" % copy_config.destination_server, auth=auth)
+        response1 = http.http_get_request("%s/collaborations" % copy_config.destination_server, auth=auth,
+                                          stream=True)
         if not http.verify(response1, logger):
             raise CCTError("FAILURE getting pending role requests: %s %s" % (response1.status_code, response1.reason))
-        else:
-            html = response1.text
-            pattern = regex.compile('name="ids:list" value=".*"')
-            matching_items = regex.finditer(pattern, html)
-            for match in matching_items:
-                string = match.group(0)
-                ids.append(string[string.find('value="') + 7:-1])
-        return ids
+        return parsing.find_role_request_ids(response1)
 
     def get_users_of_roles(self):
         users = set()
@@ -0,0 +1,141 @@
+import json
+import logging
+import threading
+from os import getpid, path, rename
+
+import http_util as http
+
+"""
+This file contains the scheduling of module copies for the content-copy-tool.
+
+When modules are copied by several workers, a big module that comes last in
+the bookmap keeps one worker busy long after the others have finished. The
+source export sizes are looked up first (in the size cache written by earlier
+runs, otherwise with a HEAD request) and the copies are started largest first.
+What each copy logs is kept in a buffer and written out in bookmap order, so
+the log reads the same as a sequential run.
+"""
+
+
+class ExportSizeCache:
+    """ The sizes of source module exports seen in earlier runs, kept in a json file. """
+    def __init__(self, filename):
+        self.filename = filename
+        self.sizes = {}
+        self.lock = threading.Lock()
+        self.changed = False
+        if filename and path.exists(filename):
+            try:
+                with open(filename) as cache_file:
+                    self.sizes = json.load(cache_file)
+            except ValueError:
+                self.sizes = {}  # unreadable, it will be rewritten
+
+    def get(self, key):
+        with self.lock:
+            return self.sizes.get(key)
+
+    def set(self, key, size):
+        with self.lock:
+            if self.sizes.get(key) != size:
+                self.sizes[key] = size
+                self.changed = True
+
+    def save(self):
+        if not self.filename or not self.changed:
+            return
+        with self.lock:
+            temp_file = "%s.%d.tmp" % (self.filename, getpid())
+            with open(temp_file, 'w') as cache_file:
+                json.dump(self.sizes, cache_file, indent=0, sort_keys=True)
+            rename(temp_file, self.filename)
+            self.changed = False
+
+
+def export_key(source_server, source_id):
+    return "%s/content/%s" % (source_server, source_id)
+
+
+def probe_export_size(source_server, source_id):
+    """ Returns the Content-Length of the source module export, or None if the server does not tell. """
+    try:
+        response = http.http_head_request("%s/content/%s/latest/module_export?format=zip" %
+                                          (source_server, source_id))
+    except Exception:
+        return None
+    length = response.headers.get('Content-Length')
+    if response.status_code >= 400 or not length:
+        return None
+    return int(length)
+
+
+def probe_sizes(modules, source_server, cache, workers=4):
+    """
+    Returns a dictionary mapping the source id of each module to the size of
+    its export, taken from the cache or probed with HEAD requests (concurrently).
+    Sizes that could not be found are left out.
+    """
+    sizes = {}
+    unknown = []
+    for module in modules:
+        size = cache.get(export_key(source_server, module.source_id))
+        if size is None:
+            unknown.append(module.source_id)
+        else:
+            sizes[module.source_id] = size
+    if unknown:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(max(1, min(workers, len(unknown))))
+        try:
+            for source_id, size in zip(unknown, pool.map(lambda source_id: probe_export_size(source_server, source_id),
+                                                         unknown)):
+                if size is not None:
+                    sizes[source_id] = size
+        finally:
+            pool.close()
+            pool.join()
+    return sizes
+
+
+def largest_first(modules, sizes):
+    """
+    Returns the modules ordered by export size, largest first. Modules of
+    unknown size are given the average known size; ties keep bookmap order.
+    """
+    known = [sizes[module.source_id] for module in modules if module.source_id in sizes]
+    default = sum(known) / len(known) if known else 0
+    indexed = list(enumerate(modules))
+    indexed.sort(key=lambda item: (-sizes.get(item[1].source_id, default), item[0]))
+    return [module for index, module in indexed]
+
+
+class BufferedLogger:
+    """
+    Stands in for the tool's logger while a module is copied by a worker, and
+    keeps the records until flush() writes them to the logger.
+    """
+    def __init__(self, logger):
+        self.logger = logger
+        self.records = []
+
+    def log(self, level, msg, *args, **kwargs):
+        self.records.append((level, msg, args, kwargs))
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warn(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    warning = warn
+
+    def error(self, msg, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
+
+    def flush(self):
+        for level, msg, args, kwargs in self.records:
+            self.logger.log(level, msg, *args, **kwargs)
+        self.records = []
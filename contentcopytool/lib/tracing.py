@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+"""
+This file contains the span tracing of the content-copy-tool.
+
+When a tracer is installed (--trace), the steps of the pipeline of each module
+(export and receipt download, role rewrite, zip clean, multipart build,
+upload, publish, collection add), the phases of the run and every HTTP
+request are recorded as spans with their phase, worker thread and the bytes
+they moved. At the end of the run the spans are written in the Chrome trace
+event format, which chrome://tracing and https://ui.perfetto.dev open.
+
+Without a tracer, span() and phase() do nothing.
+"""
+
+tracer = None
+
+
+@contextmanager
+def nothing():
+    yield
+
+
+def span(name, **args):
+    """ Records the body of the with statement as a span of the module pipeline. """
+    if tracer is None:
+        return nothing()
+    return tracer.span(name, 'module', **args)
+
+
+def phase(name):
+    """ Records the body of the with statement as the phase [name] of the run. """
+    if tracer is None:
+        return nothing()
+    return tracer.phase(name)
+
+
+class Tracer:
+    """ Collects spans and writes them as Chrome trace events. """
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.events = []
+        self.threads = {}  # thread ident -> (worker id, thread name)
+        self.local = threading.local()
+        self.current_phase = None
+        self.start = time.time()
+
+    def now(self):
+        return int((time.time() - self.start) * 1e6)  # microseconds
+
+    def worker_id(self):
+        thread = threading.current_thread()
+        with self.lock:
+            if thread.ident not in self.threads:
+                self.threads[thread.ident] = (len(self.threads) + 1, thread.name)
+            return self.threads[thread.ident][0]
+
+    def stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def begin(self, name, category, args):
+        record = {'name': name, 'cat': category, 'ph': 'X', 'ts': self.now(), 'pid': os.getpid(),
+                  'tid': self.worker_id(), 'args': dict(args, phase=self.current_phase, bytes_down=0, bytes_up=0)}
+        self.stack().append(record)
+        return record
+
+    def end(self, record, **args):
+        stack = self.stack()
+        if record in stack:
+            stack.remove(record)
+        record['dur'] = self.now() - record['ts']
+        record['args'].update(args)
+        if stack:  # the bytes of a span count for the span around it
+            stack[-1]['args']['bytes_down'] += record['args']['bytes_down']
+            stack[-1]['args']['bytes_up'] += record['args']['bytes_up']
+        with self.lock:
+            self.events.append(record)
+
+    @contextmanager
+    def span(self, name, category='module', **args):
+        record = self.begin(name, category, args)
+        try:
+            yield record
+        except Exception as e:
+            record['args']['error'] = "%s" % getattr(e, 'msg', e)
+            raise
+        finally:
+            self.end(record)
+
+    @contextmanager
+    def phase(self, name):
+        previous = self.current_phase
+        self.current_phase = name
+        try:
+            with self.span(name, 'phase'):
+                yield
+        finally:
+            self.current_phase = previous
+
+    # http_util listener interface
+    def request_started(self, kind, url):
+        self.begin("%s %s" % (kind, metrics.operation_name(url)), 'http', {'url': url})
+
+    def request_finished(self, kind, url, status, bytes_down, bytes_up, elapsed):
+        stack = self.stack()
+        if stack and stack[-1]['cat'] == 'http':
+            self.end(stack[-1], status=status, bytes_down=bytes_down, bytes_up=bytes_up)
+
+    def save(self):
+        """ Writes the trace file and returns the number of spans in it. """
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': worker_id,
+                     'args': {'name': "%s (worker %d)" % (thread_name, worker_id)}}
+                    for worker_id, thread_name in threads.itervalues()]
+        metadata.append({'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 0,
+                         'args': {'name': 'content-copy-tool'}})
+        with open(self.filename, 'w') as trace_file:
+            json.dump({'traceEvents': metadata + sorted(events, key=lambda event: event['ts']),
+                       'displayTimeUnit': 'ms'}, trace_file)
+        return len(events)
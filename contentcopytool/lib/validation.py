@@ -0,0 +1,122 @@
+import json
+import time
+from os import path
+from urlparse import urlparse
+
+"""
+This file contains the validation of the input of the content-copy-tool.
+
+Every selected row of the bookmap is checked against what the run will do
+before the first request is made, so a broken input file is reported in full
+at once instead of one module at a time during the run. The same checks are
+used by the copier for each module it copies.
+"""
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalized_host(url):
+    """ Returns the scheme-less, lower case host[:port] of a url, without the default port. """
+    if '://' not in url:
+        url = "http://%s" % url
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    if parsed.port and parsed.port != DEFAULT_PORTS.get(parsed.scheme):
+        host = "%s:%d" % (host, parsed.port)
+    return host
+
+
+def missing(value):
+    return value is None or str(value).strip() == ''
+
+
+def workspace_problem(module, destination_host):
+    """ Returns what is wrong with the destination workspace url of the module, or None. """
+    if missing(module.destination_workspace_url):
+        return "no destination workspace url"
+    parsed = urlparse(module.destination_workspace_url)
+    if parsed.scheme not in ('http', 'https'):
+        return "destination workspace url %s is not an http(s) url" % module.destination_workspace_url
+    if normalized_host(module.destination_workspace_url) != destination_host:
+        return "destination workspace %s is not on the destination server %s" % \
+               (module.destination_workspace_url, destination_host)
+    return None
+
+
+def module_problems(module, run_options, destination_host):
+    """ Returns the list of problems that would make the operations of the run fail for the module. """
+    problems = []
+    placeholders = run_options.modules or run_options.workgroups
+    if missing(module.title):
+        problems.append("no module title")
+    if (run_options.copy or run_options.export_bundle) and missing(module.source_id):
+        problems.append("no source module ID")
+    if run_options.copy:
+        if not placeholders:
+            problem = workspace_problem(module, destination_host)
+            if problem:
+                problems.append(problem)
+    if not placeholders and missing(module.destination_id) and \
+            (run_options.copy or run_options.publish or run_options.collections):
+        problems.append("no destination module ID")
+    elif placeholders and not missing(module.destination_workspace_url):
+        problem = workspace_problem(module, destination_host)  # placeholders are created in that workspace
+        if problem:
+            problems.append(problem)
+    return problems
+
+
+def validate(bookmap, copy_config, run_options, source=None):
+    """
+    Checks every selected module of the bookmap, and with a source (the
+    copier's) that the modules to copy are in it.
+
+    Returns:
+        A list of (module, problem) pairs, in bookmap order, and a list of
+        warnings that do not stop a module (duplicate source module IDs).
+    """
+    destination_host = normalized_host(copy_config.destination_server)
+    problems = []
+    warnings = []
+    sources = {}
+    for module in bookmap.bookmap.modules:
+        if not module.valid or module.chapter_number not in bookmap.chapters:
+            continue
+        for problem in module_problems(module, run_options, destination_host):
+            problems.append((module, problem))
+        if run_options.copy and source is not None and not missing(module.source_id) \
+                and not source.has(module.source_id):
+            problems.append((module, "source module %s is not in the bundle" % module.source_id))
+        if (run_options.copy or run_options.export_bundle) and not missing(module.source_id):
+            if module.source_id in sources:
+                warnings.append((module, "source module ID %s is also used by %s" %
+                                 (module.source_id, sources[module.source_id].title)))
+            sources.setdefault(module.source_id, module)
+    return problems, warnings
+
+
+def write_report(bookmap, problems, warnings, elapsed):
+    """ Writes the problems as json next to the input file and returns the file name. """
+    file_root, file_ext = path.splitext(bookmap.filename)
+    if bookmap.name:
+        file_root = "%s_%s" % (file_root, bookmap.name)
+    report_file = "%s_validation_%s.json" % (file_root, time.strftime("%Y%m%d-%H%M%S"))
+
+    def entry(module, message):
+        return {'chapter': module.chapter_number,
+                'title': module.title,
+                'source_id': module.source_id,
+                'destination_id': module.destination_id,
+                'destination_workspace_url': module.destination_workspace_url,
+                'problem': message}
+    selected = [module for module in bookmap.bookmap.modules if module.chapter_number in bookmap.chapters]
+    report = {'input_file': bookmap.filename,
+              'chapters': bookmap.chapters,
+              'modules_checked': len(selected),
+              'modules_with_problems': len(set(id(module) for module, message in problems)),
+              'seconds': round(elapsed, 4),
+              'problems': [entry(module, message) for module, message in problems],
+              'warnings': [entry(module, message) for module, message in warnings]}
+    with open(report_file, 'w') as report_output:
+        json.dump(report, report_output, indent=2, sort_keys=True)
+    return report_file
@@ -0,0 +1,130 @@
+import shutil
+import tempfile
+import traceback
+from os import getpid, path
+
+import http_util as http
+from util import CCTError, TerminateError
+
+"""
+This file contains the post-copy verification of the content-copy-tool.
+
+Each copied module is exported again from the destination server and the
+entries of its zip are compared with the source export by the CRC and size
+recorded in the zip central directory, so nothing is extracted. The source
+digests are taken from the zip the copier uploaded when the module was copied
+in the same run, otherwise the source export is downloaded as well.
+"""
+
+IGNORED_FILES = ['index.cnxml.html']  # removed from the source zip by the copier
+
+
+def zip_digests(zipfilename):
+    """
+    Returns a dictionary mapping each file in the zip (without the directories
+    that all the files are in: the module id in an export, the path of the
+    tool as well in a zip cleaned by the copier) to its (CRC, size).
+    """
+    import zipfile
+    with zipfile.ZipFile(zipfilename, 'r') as zipf:
+        infos = [info for info in zipf.infolist() if not info.filename.endswith('/')]
+    prefix = path.commonprefix([info.filename.split('/')[:-1] for info in infos]) if infos else []
+    digests = {}
+    for info in infos:
+        name = '/'.join(info.filename.split('/')[len(prefix):])
+        if path.basename(name) in IGNORED_FILES:
+            continue
+        digests[name] = (info.CRC, info.file_size)
+    return digests
+
+
+def compare_digests(source, destination):
+    """ Returns the (changed, missing on destination, extra on destination) file names. """
+    changed = sorted(name for name in source if name in destination and source[name] != destination[name])
+    missing = sorted(name for name in source if name not in destination)
+    extra = sorted(name for name in destination if name not in source)
+    return changed, missing, extra
+
+
+class Verifier:
+    """ Compares the destination exports of copied modules with their source exports. """
+    def __init__(self, config, source_digests=None, workers=4):
+        self.config = config
+        self.source_digests = source_digests if source_digests is not None else {}
+        self.workers = workers
+
+    def export_digests(self, url, auth, workdir, name):
+        import zipfile
+        filename = http.http_download_file(url, path.join(workdir, name), '.zip', auth=auth)
+        try:
+            return zip_digests(filename)
+        except zipfile.BadZipfile:
+            raise CCTError("%s is not a zip file" % url)
+
+    def verify_module(self, module, workdir):
+        """ Returns (module, changed, missing, extra) or (module, error message). """
+        auth = tuple(self.config.credentials.split(':'))
+        try:
+            source = self.source_digests.get(module.source_id)
+            if source is None:
+                source = self.export_digests("%s/content/%s/latest/module_export?format=zip&nonce=%s" %
+                                             (self.config.source_server, module.source_id, getpid()),
+                                             None, workdir, "source-%s" % module.source_id)
+            destination = self.export_digests("%s/%s/module_export?format=zip&nonce=%s" %
+                                              (module.destination_workspace_url, module.destination_id, getpid()),
+                                              auth, workdir, "destination-%s" % module.destination_id)
+            return (module,) + compare_digests(source, destination)
+        except TerminateError:
+            raise
+        except Exception as e:
+            return module, "%s" % getattr(e, 'msg', e), traceback.format_exc()
+
+    def verify(self, modules, logger, failures, progress=None):
+        """
+        Verifies the given modules concurrently and logs the modules and files
+        that differ.
+
+        Returns:
+            The number of modules that differ or could not be verified.
+        """
+        logger.info("-------- Verifying %d modules ----------------------------" % len(modules))
+        if progress:
+            progress.start_phase('verify', len(modules))
+        from multiprocessing.pool import ThreadPool
+        workdir = tempfile.mkdtemp(prefix='cct-verify-')
+        pool = ThreadPool(max(1, self.workers))
+        differing = 0
+        try:
+            results = pool.imap(lambda module: self.verify_module(module, workdir), modules)
+            for result in results:
+                module = result[0]
+                ok = len(result) == 4 and not any(result[1:])
+                if progress:
+                    progress.module_done(ok)
+                if ok:
+                    logger.debug("[VERIFIED] %s - %s" % (module.destination_id, module.full_title()))
+                    continue
+                differing += 1
+                if len(result) == 3:
+                    logger.error("Could not verify module %s - %s: %s" %
+                                 (module.destination_id, module.full_title(), result[1]))
+                    logger.debug(result[2])
+                    failures.append((module.full_title(), "verifying module"))
+                    continue
+                changed, missing, extra = result[1:]
+                logger.error("Module %s (source %s) - %s differs from the source:" %
+                             (module.destination_id, module.source_id, module.full_title()))
+                for label, names in (("changed", changed), ("missing on destination", missing),
+                                     ("only on destination", extra)):
+                    if names:
+                        logger.error("    %s: %s" % (label, ', '.join(names)))
+                failures.append((module.full_title(), "verifying module (content differs)"))
+        finally:
+            pool.close()
+            pool.join()
+            shutil.rmtree(workdir, ignore_errors=True)
+            if progress:
+                progress.finish_phase()
+        logger.info("Verified %d modules, \033[95m%d\033[0m differ or could not be verified" %
+                    (len(modules), differing))
+        return differing